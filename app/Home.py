@@ -3,26 +3,26 @@ import sys
 import pysqlite3
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
-from preprocess import encode_image
-from agents import agent1_food_image_caption, agent2_nutrition_augmentation, agent3_parse_nutrition, agent4_create_summary
+from agents import agent1_food_image_caption, agent2_nutrition_augmentation, agent2_nutrition_augmentation_stream, agent3_parse_nutrition, agent4_create_summary
 import chromadb
 import chromadb.config
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 import streamlit as st
-import boto3
 from PIL import Image
 import os
 import pandas as pd
 from preprocess import upload_image
+from retrieval import lookup_ingredients
+from vector_store import get_vector_store, get_lexical_index, get_nutrient_store, is_vector_store_ready, warm_up_vector_store
+from pipeline import collect_post_processing, run_image_analysis, start_post_processing, timed
+from analysis_cache import get_analysis_cache, get_augmentation_cache, image_sha256
 import streamlit as st
 import json
 
 from streamlit_google_auth import Authenticate
 from mongodb import MongoDB
-import datetime
 from user import show_user_profile
 import tempfile
+from functools import partial
 
 import google.oauth2.credentials
 import google_auth_oauthlib.flow
@@ -38,87 +38,60 @@ OPENAI_API_KEY = st.secrets["general"]["OPENAI_API_KEY"]
 #         persist_directory="../data/food_db/vector_db_json"
 #     )
 
-def download_s3_bucket(bucket_name, local_dir):
-    # Create an S3 client
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=st.secrets["aws"]["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=st.secrets["aws"]["AWS_SECRET_ACCESS_KEY"],
-        region_name=st.secrets["aws"]["AWS_DEFAULT_REGION"]
-    )
-
-    paginator = s3.get_paginator('list_objects_v2')
-    operation_parameters = {'Bucket': bucket_name}
-    
-    for page in paginator.paginate(**operation_parameters):
-        if 'Contents' in page:
-            for obj in page['Contents']:
-                key = obj['Key']
-                local_file_path = os.path.join(local_dir, key)
-
-                # Create local directory structure if it doesn't exist
-                os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-
-                # Download the file
-                print(f"Downloading {key} to {local_file_path}")
-                s3.download_file(bucket_name, key, local_file_path)
-
 def initialize_db():
-    """Initialize database connection if not already in session state"""
-    if 'vector_db' not in st.session_state:
-        with st.spinner("Loading database..."):
-            # Define S3 and local paths
-            bucket_name = "food-ai-db" 
-            local_dir = "../data/food_db_cloud/" 
-
-            # Call the function
-            download_s3_bucket(bucket_name, local_dir)
-
-            db_path = os.path.join(local_dir, "vector_db_json")
-
-            # Load the Chroma database
-            st.session_state.vector_db = Chroma(
-                collection_name="food_items_collection",
-                embedding_function=OpenAIEmbeddings(model="text-embedding-3-large", api_key=st.secrets["general"]["OPENAI_API_KEY"]),
-                persist_directory=db_path
-            )
-    return st.session_state.vector_db
+    """Return the process-wide vector store, showing a spinner only while it is being loaded"""
+    if is_vector_store_ready():
+        return get_vector_store()
+    with st.spinner("Loading database..."):
+        return get_vector_store()
 
-def save_analysis_to_db(email, image_data, ingredients, nutrition_info, nutrition_df, augmented_info):
+def build_nutrition_df(display_info, ingredient_descriptions, nutrient_store):
     """
-    Save the food analysis results to MongoDB
+    Build the per-ingredient nutrition table (per 100g). Uses vectorized lookups in the
+    columnar nutrient store when every matched food is in it, otherwise parses the
+    nutrient strings stored in the Chroma metadata.
     """
-    try:
-        with MongoDB() as mongo:
-            analysis_data = {
-                "date": datetime.datetime.utcnow(),
-                "image": image_data,
-                "ingredients": ingredients,
-                "nutrition_info": nutrition_info,
-                "nutrition_df": nutrition_df.to_dict() if nutrition_df is not None else {},
-                "augmented_info": augmented_info
-            }
-            
-            # Update user document, adding new analysis to food_history
-            result = mongo.users.update_one(
-                {"email": email},
-                {
-                    "$setOnInsert": {
-                        "email": email,
-                        "created_at": datetime.datetime.utcnow()
-                    },
-                    "$push": {
-                        "food_history": analysis_data
-                    }
-                },
-                upsert=True
-            )
-            
-            return True, "Analysis saved successfully!"
-            
-    except Exception as e:
-        st.error(f"Error saving to database: {str(e)}")
-        return False, str(e)
+    labels = list(display_info.keys())
+    if nutrient_store is not None:
+        indices = [nutrient_store.index_of(ingredient_descriptions[label]) for label in labels]
+        if None not in indices:
+            return nutrient_store.to_frame(labels, indices)
+
+    # Convert nutrition info to a DataFrame for better display
+    nutrition_df = pd.DataFrame.from_dict(display_info, orient='index').reset_index()
+    nutrition_df.columns = ["Ingredient", "Carbohydrate (g)", "Energy (kcal)", "Protein (g)", "Fat (g)"]
+
+    # Customize the DataFrame for a better display
+    nutrition_df["Carbohydrate (g)"] = nutrition_df["Carbohydrate (g)"].apply(lambda x: x.split()[0])
+    nutrition_df["Protein (g)"] = nutrition_df["Protein (g)"].apply(lambda x: x.split()[0])
+    nutrition_df["Fat (g)"] = nutrition_df["Fat (g)"].apply(lambda x: x.split()[0])
+    nutrition_df["Energy (kcal)"] = nutrition_df["Energy (kcal)"].apply(lambda x: x.split()[0])
+    return nutrition_df
+
+# Parts of current_analysis stored in the analysis cache (nutrition_df is serialized separately)
+CACHED_ANALYSIS_KEYS = [
+    'ingredients', 'encoded_image', 'image_mime_type', 'nutrition_info', 'display_info', 'match_scores',
+    'nutrition_augmentation', 'final_nutrition_info', 'text_summary'
+]
+
+def cacheable_analysis(current_analysis):
+    """Return the JSON-serializable part of an analysis for the analysis cache"""
+    analysis = {key: current_analysis[key] for key in CACHED_ANALYSIS_KEYS if key in current_analysis}
+    analysis['nutrition_df'] = current_analysis['nutrition_df'].to_dict(orient='split')
+    return analysis
+
+def restore_cached_analysis(cached_analysis, uploaded_file, timings):
+    """Rebuild a session analysis from an analysis cache entry"""
+    analysis = dict(cached_analysis)
+    analysis['nutrition_df'] = pd.DataFrame(**cached_analysis['nutrition_df'])
+    analysis['uploaded_file'] = uploaded_file
+    analysis['timings'] = timings
+    return analysis
+
+def cache_post_processing_result(analysis_cache, image_bytes, key, future):
+    """Done-callback storing a finished background agent3/agent4 result in the analysis cache"""
+    if future.exception() is None:
+        analysis_cache.update(image_bytes, **{key: future.result()})
 
 @st.cache_data
 def get_source_information():
@@ -241,36 +214,48 @@ if __name__ == "__main__":
     if uploaded_file is None:
         st.info("Please upload a JPG, PNG, or JPEG image of your food to get started!")
     else:
-        # Clear session state if a new image is uploaded
-        current_file_name = getattr(uploaded_file, 'name', None)
-        if 'last_uploaded_file' not in st.session_state or st.session_state.last_uploaded_file != current_file_name:
+        # Clear session state if a different image is uploaded (by content, not file name)
+        image_bytes = uploaded_file.getvalue()
+        current_image_hash = image_sha256(image_bytes)
+        if 'last_uploaded_hash' not in st.session_state or st.session_state.last_uploaded_hash != current_image_hash:
             if 'current_analysis' in st.session_state:
                 del st.session_state.current_analysis
-            st.session_state.last_uploaded_file = current_file_name
+            st.session_state.last_uploaded_hash = current_image_hash
+
+        analysis_cache = get_analysis_cache(
+            near_duplicates=st.secrets.get("analysis_cache", {}).get("near_duplicates", False)
+        )
 
         # Initialize analysis if not already done
         if 'current_analysis' not in st.session_state:
             st.session_state.current_analysis = {}
             
             image = Image.open(uploaded_file)
-            upload_image(uploaded_file)
             st.image(image, caption="Uploaded Food Image", use_container_width=True)
 
-            # Encode image and extract ingredients
-            with st.spinner("Processing image to extract food ingredients..."):
-                encoded_image = encode_image(uploaded_file)
-                ingredients = agent1_food_image_caption(encoded_image)
-
-            if ingredients[0] == 'False':
-                st.error("Sorry, we couldn't identify the food in the image. Please try again with a clearer image.")
-                st.stop()
-
-            # Store all analysis results in session state
-            st.session_state.current_analysis = {
-                'ingredients': ingredients,
-                'encoded_image': encoded_image,
-                'uploaded_file': uploaded_file
-            }
+            # The same image was analyzed before: reuse everything without any OpenAI call
+            lookup_timings = {}
+            cached_analysis = timed(lookup_timings, "analysis_cache_lookup", analysis_cache.get, image_bytes)
+            if cached_analysis is not None:
+                st.session_state.current_analysis = restore_cached_analysis(cached_analysis, uploaded_file, lookup_timings)
+            else:
+                # Upload to S3, extract ingredients and warm up the vector DB concurrently
+                with st.spinner("Processing image to extract food ingredients..."):
+                    ingredients, encoded_image, mime_type, image_key, timings = run_image_analysis(uploaded_file, warm_up=warm_up_vector_store)
+
+                if ingredients[0] == 'False':
+                    st.error("Sorry, we couldn't identify the food in the image. Please try again with a clearer image.")
+                    st.stop()
+
+                # Store all analysis results in session state
+                st.session_state.current_analysis = {
+                    'ingredients': ingredients,
+                    'encoded_image': encoded_image,
+                    'image_mime_type': mime_type,
+                    'image_key': image_key,
+                    'uploaded_file': uploaded_file,
+                    'timings': timings
+                }
 
         # Now we can safely access the ingredients
         ingredients = st.session_state.current_analysis['ingredients']
@@ -284,15 +269,26 @@ if __name__ == "__main__":
                 db = initialize_db()
                 nutrition_info = {}
                 display_info = {}
-                for ingredient in ingredients:
-                    similar_doc = db.similarity_search(ingredient, k=1)
-                    food_description = similar_doc[0].page_content if similar_doc else None
-                    metadata = similar_doc[0].metadata
-                    display_info[ingredient] = metadata
-                    nutrition_info[food_description] = metadata
-                
+                ingredient_descriptions = {}
+                match_scores = {}
+                # Lexical fast path first, then one embedding call and one Chroma query for the rest
+                matches = timed(st.session_state.current_analysis.setdefault('timings', {}), "retrieval",
+                                lookup_ingredients, db, ingredients, lexical_index=get_lexical_index())
+                for match in matches:
+                    if match['description'] is None:
+                        continue
+                    display_info[match['ingredient']] = match['metadata']
+                    nutrition_info[match['description']] = match['metadata']
+                    ingredient_descriptions[match['ingredient']] = match['description']
+                    match_scores[match['ingredient']] = match['score']
+
                 st.session_state.current_analysis['nutrition_info'] = nutrition_info
+                st.session_state.current_analysis['match_scores'] = match_scores
                 st.session_state.current_analysis['display_info'] = display_info
+                # Built once per analysis instead of re-parsed on every rerun
+                st.session_state.current_analysis['nutrition_df'] = build_nutrition_df(
+                    display_info, ingredient_descriptions, get_nutrient_store()
+                )
 
         # Use stored nutrition info for display
         display_info = st.session_state.current_analysis['display_info']
@@ -301,15 +297,7 @@ if __name__ == "__main__":
         # Prepare a cleaner table
         st.subheader("🍽️ Nutrition Facts for Each Ingredient (per 100g)")
 
-        # Convert nutrition info to a DataFrame for better display
-        nutrition_df = pd.DataFrame.from_dict(display_info, orient='index').reset_index()
-        nutrition_df.columns = ["Ingredient", "Carbohydrate (g)", "Energy (kcal)", "Protein (g)", "Fat (g)"]
-
-        # Customize the DataFrame for a better display
-        nutrition_df["Carbohydrate (g)"] = nutrition_df["Carbohydrate (g)"].apply(lambda x: x.split()[0])
-        nutrition_df["Protein (g)"] = nutrition_df["Protein (g)"].apply(lambda x: x.split()[0])
-        nutrition_df["Fat (g)"] = nutrition_df["Fat (g)"].apply(lambda x: x.split()[0])
-        nutrition_df["Energy (kcal)"] = nutrition_df["Energy (kcal)"].apply(lambda x: x.split()[0])
+        nutrition_df = st.session_state.current_analysis['nutrition_df']
 
         # Display as a pretty table in Streamlit
         st.table(nutrition_df)
@@ -329,18 +317,44 @@ if __name__ == "__main__":
         combining data and analysis to provide you with a richer understanding of your food choices.
         """)
 
-        # Generate augmented nutrition information only if not already generated
+        # Generate augmented nutrition information only if not already generated,
+        # rendering it chunk by chunk as the model streams it
         if 'nutrition_augmentation' not in st.session_state.current_analysis:
-            with st.spinner("Generating augmented nutrition information..."):
-                nutrition_augmentation = agent2_nutrition_augmentation(
-                    st.session_state.current_analysis['encoded_image'], 
-                    nutrition_info, 
-                    ingredients
-                )
-                st.session_state.current_analysis['nutrition_augmentation'] = nutrition_augmentation
-
-        # Display the stored augmented information
-        st.markdown(f"""{st.session_state.current_analysis['nutrition_augmentation']}""")
+            # Same ingredients matched to the same USDA foods can reuse an earlier
+            # augmentation when the [augmentation_cache] policy allows it
+            augmentation_cache = get_augmentation_cache(**st.secrets.get("augmentation_cache", {}))
+            nutrition_augmentation = augmentation_cache.get(
+                ingredients, nutrition_info, st.session_state.current_analysis.get('match_scores')
+            )
+            if nutrition_augmentation is not None:
+                st.markdown(nutrition_augmentation)
+                st.caption("♻️ Reused the analysis of a previous meal with the same ingredients.")
+            else:
+                usage = {}
+                nutrition_augmentation = st.write_stream(agent2_nutrition_augmentation_stream(
+                    st.session_state.current_analysis['encoded_image'],
+                    nutrition_info,
+                    ingredients,
+                    timings=st.session_state.current_analysis.setdefault('timings', {}),
+                    mime_type=st.session_state.current_analysis.get('image_mime_type', 'image/jpeg'),
+                    usage=usage
+                ))
+                augmentation_cache.put(ingredients, nutrition_info, nutrition_augmentation.strip(),
+                                       usage.get("total_tokens", 0))
+            st.session_state.current_analysis['nutrition_augmentation'] = nutrition_augmentation.strip()
+            analysis_cache.put(image_bytes, cacheable_analysis(st.session_state.current_analysis))
+            # Opt-in: prepare what "Save Analysis" needs while the user reads the results.
+            # This hides agent3/agent4 latency on save but pays for both calls on every
+            # analysis, including the ones that are never saved.
+            speculative = st.secrets.get("post_processing", {}).get("speculative", False)
+            if speculative and st.session_state.get('connected', False):
+                post_processing = start_post_processing(st.session_state.current_analysis['nutrition_augmentation'])
+                for key, future in post_processing.items():
+                    future.add_done_callback(partial(cache_post_processing_result, analysis_cache, image_bytes, key))
+                st.session_state.current_analysis['post_processing'] = post_processing
+        else:
+            # Display the stored augmented information
+            st.markdown(f"""{st.session_state.current_analysis['nutrition_augmentation']}""")
 
 
 
@@ -356,6 +370,13 @@ if __name__ == "__main__":
             for ingredient, description in st.session_state.current_analysis['matched_descriptions'].items():
                 st.write(f"- **{ingredient}**:  {description}.")
 
+        with st.expander("⏱️ Analysis Timings"):
+            for stage, seconds in st.session_state.current_analysis.get('timings', {}).items():
+                st.write(f"- **{stage}**: {seconds:.2f}s")
+            augmentation_stats = get_augmentation_cache(**st.secrets.get("augmentation_cache", {})).stats()
+            st.write(f"- **augmentation cache**: {augmentation_stats['hit_rate']:.0%} hit rate, "
+                     f"{augmentation_stats['saved_tokens']} tokens saved")
+
         # Save Analysis section
         if st.session_state.get('connected', False):
             email = st.session_state['user_info'].get('email')
@@ -363,20 +384,32 @@ if __name__ == "__main__":
             # Add a save button
             if st.button("Save Analysis"):
                 try:
-                    # Use stored file for saving
-                    uploaded_file = st.session_state.current_analysis['uploaded_file']
-                    uploaded_file.seek(0)
-                    image_data = uploaded_file.read()
+                    # The image is stored in S3 and only referenced by the meal document;
+                    # analyses restored from the cache have not been uploaded yet
+                    image_key = st.session_state.current_analysis.get('image_key')
+                    if image_key is None:
+                        image_key = upload_image(st.session_state.current_analysis['uploaded_file'])
+                        st.session_state.current_analysis['image_key'] = image_key
                     
                     nutrition_augmentation = st.session_state.current_analysis['nutrition_augmentation']
-                    final_nutrition_info = agent3_parse_nutrition(nutrition_augmentation)
-                    text_summary = agent4_create_summary(nutrition_augmentation)
+                    if 'final_nutrition_info' in st.session_state.current_analysis and 'text_summary' in st.session_state.current_analysis:
+                        # Restored from the analysis cache
+                        final_nutrition_info = st.session_state.current_analysis['final_nutrition_info']
+                        text_summary = st.session_state.current_analysis['text_summary']
+                    else:
+                        # agent3 and agent4 run concurrently, started here unless they were
+                        # already started speculatively
+                        final_nutrition_info, text_summary = collect_post_processing(
+                            nutrition_augmentation,
+                            st.session_state.current_analysis.get('post_processing')
+                        )
+                        analysis_cache.update(image_bytes, final_nutrition_info=final_nutrition_info, text_summary=text_summary)
                     
                     # Create MongoDB instance and save
                     mongo = MongoDB()
                     mongo.save_analysis(
                         email=email,
-                        image_data=image_data,
+                        image_key=image_key,
                         ingredients=st.session_state.current_analysis['ingredients'],
                         final_nutrition_info=final_nutrition_info,
                         text_summary=text_summary
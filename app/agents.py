@@ -1,30 +1,132 @@
 import os
-from openai import OpenAI
+import asyncio
+import random
+import httpx
+from openai import (APIConnectionError, APIStatusError, AsyncOpenAI, DefaultAsyncHttpxClient,
+                    DefaultHttpxClient, OpenAI, RateLimitError)
 from dotenv import load_dotenv
 import streamlit as st
 import json
+import threading
+import time
+from nutrition_parser import parse_summary_table
 
 load_dotenv()
 api_key = st.secrets["general"]["OPENAI_API_KEY"]
 
-def agent1_food_image_caption(encoded_image: str) -> str:
+# Per-agent request timeouts in seconds, overridable via the [openai_timeouts] secrets section
+AGENT_TIMEOUTS = {"agent1": 30.0, "agent2": 90.0, "agent3": 30.0, "agent4": 30.0}
+AGENT_TIMEOUTS.update(st.secrets.get("openai_timeouts", {}))
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+# Process-wide clients so HTTP keep-alive connections and TLS sessions are reused across calls
+_clients = {}
+_clients_lock = threading.Lock()
+_retry_stats = {"calls": 0, "retries": 0, "failures": 0}
+_retry_stats_lock = threading.Lock()
+
+
+def _shared_client(kind: str):
+    with _clients_lock:
+        if kind not in _clients:
+            limits = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+            if kind == "async":
+                _clients[kind] = AsyncOpenAI(api_key=api_key, max_retries=0,
+                                             http_client=DefaultAsyncHttpxClient(limits=limits))
+            else:
+                _clients[kind] = OpenAI(api_key=api_key, max_retries=0,
+                                        http_client=DefaultHttpxClient(limits=limits))
+        return _clients[kind]
+
+
+def get_client(agent: str) -> OpenAI:
+    """Return the shared, connection-pooled OpenAI client configured with the agent's timeout."""
+    return _shared_client("sync").with_options(timeout=AGENT_TIMEOUTS.get(agent, 60.0))
+
+
+def get_async_client(agent: str) -> AsyncOpenAI:
+    """Async counterpart of get_client, sharing one pooled AsyncOpenAI client per process."""
+    return _shared_client("async").with_options(timeout=AGENT_TIMEOUTS.get(agent, 60.0))
+
+
+def _is_retryable(error: Exception) -> bool:
+    # 429s, 5xx responses, timeouts and dropped connections are worth another try
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def _backoff_delay(attempt: int) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _record(key: str):
+    with _retry_stats_lock:
+        _retry_stats[key] += 1
+
+
+def call_with_retries(agent: str, fn, *args, **kwargs):
+    """Call an OpenAI API method, retrying transient errors with exponential backoff and jitter."""
+    _record("calls")
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == MAX_RETRIES or not _is_retryable(e):
+                _record("failures")
+                raise
+            _record("retries")
+            delay = _backoff_delay(attempt)
+            print(f"{agent} request failed ({e}), retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+async def acall_with_retries(agent: str, fn, *args, **kwargs):
+    """Async counterpart of call_with_retries for AsyncOpenAI methods."""
+    _record("calls")
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == MAX_RETRIES or not _is_retryable(e):
+                _record("failures")
+                raise
+            _record("retries")
+            delay = _backoff_delay(attempt)
+            print(f"{agent} request failed ({e}), retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def get_retry_stats() -> dict:
+    """Return counters of OpenAI calls, retries and calls that failed after retrying."""
+    with _retry_stats_lock:
+        return dict(_retry_stats)
+
+# How often agent3 needed the LLM because the local Summary table parse failed
+_agent3_stats = {"local": 0, "llm_fallback": 0}
+_agent3_stats_lock = threading.Lock()
+
+def agent1_food_image_caption(encoded_image: str, mime_type: str = "image/jpeg") -> str:
     """
     Take the food image (base64 encoded) and prompt (which ask to describe the food component in the image) and return the caption.
     """
-    client = OpenAI(api_key=api_key)
+    client = get_client("agent1")
 
 
     prompt = "List the major ingredients you can visually identify in the food item shown, separated by commas. Each ingredient should be described in simple terms (e.g., raw salmon, white rice). Do not include the dish name, preparation methods, quantities, or any additional commentary. Avoid using brackets, quotes, or special formatting. Example output format: raw salmon, white rice, cucumber, sesame seeds. Note: If the image is unclear or the food is unidentifiable, your response should be a simple string 'False'."
 
     try:
-        response = client.chat.completions.create(
+        response = call_with_retries("agent1", client.chat.completions.create,
             model="gpt-4o-mini", 
             messages=[
                 {
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
+                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}}
                     ]
                 }
             ],
@@ -38,44 +140,10 @@ def agent1_food_image_caption(encoded_image: str) -> str:
         raise Exception(f"Error during API call: {str(e)}")
 
 
-def agent2_nutrition_augmentation(encoded_image: str, nutrition_info: dict, ingredients: list) -> str:
+def _agent2_prompt(nutrition_info: dict, ingredients: list) -> str:
     """
-    Take the nutrition information and augment it with additional details.
+    Build agent2's nutrition augmentation prompt, shared by the blocking and streaming variants.
     """
-    # Step 1: Initialize the OpenAI client
-    client = OpenAI(api_key=api_key)
-    # Step 2: Prompt
-
-
-    # prompt = "The above nutrition facts, it describe the ingredient's nutrition per 100g. Can you then estimate the total nutrition info for the food in the provided image, based on the nutrition facts i provided to you, and also your own knowledge from your database, if you identified this food from your database, you can also directly use the information their. Simply return the nutrition info in a nice readable str format, make it concise, and easy to read. If you need to use scratch pad, you can use the scratch pad below to do your calculation. But keep the output clean(dont explicitly show our provided nutrition facts in response), especially provide a Summary Section in the end"
-
-    # prompt = f"{nutrition_info} \n\n{prompt}"
-    
-
-
-    # prompt = f"""
-    #             You are a nutrition researcher who can analyze the nutrition information for food in the provided image.
-    #             Please first identify the food in the image.
-    #             And search through your nutrition and food database to help yourself understand the nutrition details of the food.
-    #             We also provided you with the nutrition facts for each of the {ingredients} in the food. For each of the ingredients,
-    #             we find the most similar nutrition facts on USDA Food Database, here is the detailed nutrition information for your reference: {nutrition_info}.
-    #             They are based on the nutrition facts per 100g.
-    #             Thus you need to based on the food image, estimate the weight of each ingredient in the food.
-    #             Then, I want you to based on the nutrition knowledge you searched in your own database, the weight of each ingredient you esitimated, and the provided nutrition facts, to estimate the total nutrition info for the food in the provided image. Note, if you think the provided nutrition facts are irelevant, for example it mentioned the ingredients that are not in the food, you can ignore them, and use your own knowledge to estimate the nutrition info.
-
-    #             Note: Everything related to calculation, use plain text format, be super concise, NO SPECIAL FORMAT, USE PLAIN TEXT ONLY.
-
-    #             Your response will directly display to end users, so be friendly and professional, you want the user understand your analysis easily. 
-    #             Provide your response in markdown format, the title size will be similar to h3. Here are some sections you can include in your response:
-    #             Overview: 
-    #                 - The estimated weight for each ingredient in the food.
-    #             Nutrition Estimation:
-    #                 - For each ingredient, provide a simple calculation estimation walkthrough, display in plain text format, be really concise, including energy, protein, fat, and carbohydrate. (Dont need to be using exact number, just give a rough estimation, and only display unit in the end, it would be great if you can provide a range of the estimation, +/- 10% is fine, and no need to be accurate on the digit)
-    #             Summary:
-    #                 - List the total nutrition info for the food in the image, including energy, protein, fat, and carbohydrate.
-
-    #         """
-    
     prompt = f"""
             Role and Context
             You are a nutrition researcher specialized in analyzing food components and nutritional content. Your task is to analyze food items from images and provide detailed nutritional assessments.
@@ -150,17 +218,29 @@ def agent2_nutrition_augmentation(encoded_image: str, nutrition_info: dict, ingr
             Note: If provided nutrition facts seem irrelevant or inaccurate for the visible food item, rely on your nutrition knowledge database for more accurate estimations, do not over estimate the nutrition info.
 
             """
+    return prompt
+
+
+def agent2_nutrition_augmentation(encoded_image: str, nutrition_info: dict, ingredients: list,
+                                  mime_type: str = "image/jpeg") -> str:
+    """
+    Take the nutrition information and augment it with additional details.
+    """
+    # Step 1: Initialize the OpenAI client
+    client = get_client("agent2")
+    # Step 2: Prompt
+    prompt = _agent2_prompt(nutrition_info, ingredients)
 
     # Step 3: Return the augmented nutrition information
     try:
-        response = client.chat.completions.create(
+        response = call_with_retries("agent2", client.chat.completions.create,
             model="gpt-4o-mini", 
             messages=[
                 {
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
+                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}}
                     ]
                 }
             ],
@@ -172,11 +252,76 @@ def agent2_nutrition_augmentation(encoded_image: str, nutrition_info: dict, ingr
     except Exception as e:
         raise Exception(f"Error during API call: {str(e)}")
 
+def agent2_nutrition_augmentation_stream(encoded_image: str, nutrition_info: dict, ingredients: list,
+                                        timings: dict = None, mime_type: str = "image/jpeg",
+                                        usage: dict = None):
+    """
+    Streaming variant of agent2_nutrition_augmentation: yields text chunks as they arrive.
+    If a timings dict is given, "agent2_first_token" and "agent2_total" (seconds since the
+    request was sent) are recorded in it. If a usage dict is given, the prompt, completion
+    and total token counts reported at the end of the stream are stored in it.
+    """
+    client = get_client("agent2")
+    prompt = _agent2_prompt(nutrition_info, ingredients)
+
+    start = time.perf_counter()
+    try:
+        stream = call_with_retries("agent2", client.chat.completions.create,
+            model="gpt-4o-mini",
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}}
+                    ]
+                }
+            ],
+            max_tokens=1000,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        for chunk in stream:
+            if usage is not None and getattr(chunk, "usage", None) is not None:
+                usage["prompt_tokens"] = chunk.usage.prompt_tokens
+                usage["completion_tokens"] = chunk.usage.completion_tokens
+                usage["total_tokens"] = chunk.usage.total_tokens
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                if timings is not None and "agent2_first_token" not in timings:
+                    timings["agent2_first_token"] = time.perf_counter() - start
+                yield content
+    except Exception as e:
+        raise Exception(f"Error during API call: {str(e)}")
+    finally:
+        if timings is not None:
+            timings["agent2_total"] = time.perf_counter() - start
+
+def get_agent3_stats() -> dict:
+    """Return how often agent3 used the local parser vs. the LLM fallback."""
+    with _agent3_stats_lock:
+        stats = dict(_agent3_stats)
+    total = stats["local"] + stats["llm_fallback"]
+    stats["fallback_rate"] = stats["llm_fallback"] / total if total else 0.0
+    return stats
+
+
 def agent3_parse_nutrition(agent2_response: str) -> list:
     """
     Parse the nutrition summary table from agent2's response and return it as a structured list.
+    The table is parsed locally first; the LLM is only called when the local parse fails validation.
     """
-    client = OpenAI(api_key=api_key)
+    nutrition_list = parse_summary_table(agent2_response)
+    with _agent3_stats_lock:
+        _agent3_stats["local" if nutrition_list is not None else "llm_fallback"] += 1
+    if nutrition_list is not None:
+        return nutrition_list
+    print(f"Agent3 local parse failed, falling back to LLM: {get_agent3_stats()}")
+
+    client = get_client("agent3")
     
     prompt = """
     Extract the numerical ranges from the Summary section's nutrition table and convert them to a JSON format.
@@ -207,7 +352,7 @@ def agent3_parse_nutrition(agent2_response: str) -> list:
     """
 
     try:
-        response = client.chat.completions.create(
+        response = call_with_retries("agent3", client.chat.completions.create,
             model="gpt-4o",
             messages=[
                 {
@@ -240,7 +385,7 @@ def agent4_create_summary(agent2_response: str) -> str:
     Create a concise, informative summary of the nutritional analysis from agent2's response.
     Returns a brief, professional summary focusing on key nutritional aspects.
     """
-    client = OpenAI(api_key=api_key)
+    client = get_client("agent4")
     
     prompt = """
     As a professional nutritionist, create a brief, informative summary of this meal's nutritional analysis.
@@ -260,7 +405,7 @@ def agent4_create_summary(agent2_response: str) -> str:
     """
 
     try:
-        response = client.chat.completions.create(
+        response = call_with_retries("agent4", client.chat.completions.create,
             model="gpt-4o-mini",
             messages=[
                 {
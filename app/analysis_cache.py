@@ -0,0 +1,290 @@
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from embedding_cache import canonicalize
+
+DEFAULT_CACHE_PATH = "../data/analysis_cache/analyses.sqlite"
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_HAMMING_DISTANCE = 4
+
+
+def image_sha256(image_bytes: bytes) -> str:
+    """Content address of an uploaded image."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes: bytes) -> int:
+    """
+    64-bit difference hash (dHash) of an image: stays nearly identical across
+    re-encoding, resizing and small edits, unlike the SHA-256 of the bytes.
+    """
+    image = Image.open(io.BytesIO(image_bytes)).convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    # SQLite integers are signed 64-bit
+    return bits - (1 << 64) if bits >= (1 << 63) else bits
+
+
+def _hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+class AnalysisCache:
+    """
+    Persistent analysis cache keyed by the SHA-256 of the image bytes.
+
+    Each entry holds a JSON-serializable analysis (ingredients, retrieval results,
+    agent outputs) and expires after ttl_seconds. With near_duplicates enabled, an
+    exact miss falls back to the closest entry whose perceptual hash is within
+    max_hamming_distance bits.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 near_duplicates: bool = False, max_hamming_distance: int = DEFAULT_MAX_HAMMING_DISTANCE):
+        self.ttl_seconds = ttl_seconds
+        self.near_duplicates = near_duplicates
+        self.max_hamming_distance = max_hamming_distance
+        self.hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analyses (
+                sha256 TEXT PRIMARY KEY,
+                phash INTEGER,
+                analysis TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_expires_at ON analyses (expires_at)")
+        self._conn.commit()
+
+    def get(self, image_bytes: bytes):
+        """Return the cached analysis for an image, or None on a miss."""
+        sha256 = image_sha256(image_bytes)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT analysis FROM analyses WHERE sha256 = ? AND expires_at > ?", (sha256, now)
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+                return json.loads(row[0])
+
+        if self.near_duplicates:
+            analysis = self._get_near_duplicate(image_bytes, now)
+            if analysis is not None:
+                return analysis
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _get_near_duplicate(self, image_bytes: bytes, now: float):
+        try:
+            phash = perceptual_hash(image_bytes)
+        except Exception:
+            return None
+        with self._lock:
+            # Scan the small hashes only; the analysis (with its image) is loaded for the match
+            rows = self._conn.execute(
+                "SELECT sha256, phash FROM analyses WHERE phash IS NOT NULL AND expires_at > ?", (now,)
+            )
+            best = None
+            for sha256, candidate in rows:
+                distance = _hamming_distance(phash, candidate)
+                if distance <= self.max_hamming_distance and (best is None or distance < best[0]):
+                    best = (distance, sha256)
+            if best is None:
+                return None
+            row = self._conn.execute("SELECT analysis FROM analyses WHERE sha256 = ?", (best[1],)).fetchone()
+            if row is None:
+                return None
+            self.near_duplicate_hits += 1
+            return json.loads(row[0])
+
+    def put(self, image_bytes: bytes, analysis: dict):
+        """Store (or replace) the analysis of an image and purge expired entries."""
+        sha256 = image_sha256(image_bytes)
+        try:
+            phash = perceptual_hash(image_bytes)
+        except Exception:
+            phash = None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (sha256, phash, analysis, expires_at) VALUES (?, ?, ?, ?)",
+                (sha256, phash, json.dumps(analysis), now + self.ttl_seconds)
+            )
+            self._conn.execute("DELETE FROM analyses WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def update(self, image_bytes: bytes, **fields):
+        """Merge extra fields (e.g. agent3/agent4 results) into an existing entry."""
+        sha256 = image_sha256(image_bytes)
+        with self._lock:
+            row = self._conn.execute("SELECT analysis FROM analyses WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return
+            analysis = json.loads(row[0])
+            analysis.update(fields)
+            self._conn.execute(
+                "UPDATE analyses SET analysis = ? WHERE sha256 = ?", (json.dumps(analysis), sha256)
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters."""
+        with self._lock:
+            total = self.hits + self.near_duplicate_hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_duplicate_hits": self.near_duplicate_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.near_duplicate_hits) / total if total else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_analysis_cache(**kwargs) -> AnalysisCache:
+    """Return the process-wide analysis cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnalysisCache(**kwargs)
+        return _cache
+
+
+class AugmentationCache:
+    """
+    Cache of agent2 nutrition augmentations keyed on the normalized, sorted ingredient
+    set plus the matched USDA nutrition facts, so different photos of the same meal can
+    reuse one augmentation.
+
+    Agent2's estimates are portion-specific and a cached augmentation never looks at the
+    new image, so reuse is off by default. When enabled, the reuse policy still only
+    allows it for dishes with at most max_ingredients ingredients whose every retrieval
+    match scored at least min_match_score; both must be configured, otherwise the image
+    is always re-examined. Entries expire after ttl_seconds.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 enabled: bool = False, min_match_score: float = 0.0, max_ingredients: int = None):
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.min_match_score = min_match_score
+        self.max_ingredients = max_ingredients
+        self.hits = 0
+        self.misses = 0
+        self.skipped_by_policy = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS augmentations (
+                key TEXT PRIMARY KEY,
+                augmentation TEXT NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def cache_key(ingredients: list, nutrition_info: dict) -> str:
+        """Order- and spelling-insensitive key of an ingredient set and its USDA matches."""
+        normalized = sorted({canonicalize(ingredient) for ingredient in ingredients})
+        payload = json.dumps({"ingredients": normalized, "nutrition_info": nutrition_info}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def allows_reuse(self, ingredients: list, match_scores: dict = None) -> bool:
+        """Apply the reuse policy: False means the image must be re-examined by agent2."""
+        if not self.enabled or self.max_ingredients is None or not self.min_match_score:
+            return False
+        if len(set(ingredients)) > self.max_ingredients:
+            return False
+        scores = list((match_scores or {}).values())
+        if not scores or any(score is None or score < self.min_match_score for score in scores):
+            return False
+        return True
+
+    def get(self, ingredients: list, nutrition_info: dict, match_scores: dict = None):
+        """Return a reusable cached augmentation, or None."""
+        if not self.allows_reuse(ingredients, match_scores):
+            with self._lock:
+                self.skipped_by_policy += 1
+            return None
+        key = self.cache_key(ingredients, nutrition_info)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT augmentation, total_tokens FROM augmentations WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_tokens += row[1]
+            return row[0]
+
+    def put(self, ingredients: list, nutrition_info: dict, augmentation: str, total_tokens: int = 0):
+        """Store a fresh augmentation together with the tokens it cost."""
+        if not self.enabled:
+            return
+        key = self.cache_key(ingredients, nutrition_info)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO augmentations (key, augmentation, total_tokens, expires_at) VALUES (?, ?, ?, ?)",
+                (key, augmentation, total_tokens, now + self.ttl_seconds)
+            )
+            self._conn.execute("DELETE FROM augmentations WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Return hit rate, policy skips and the OpenAI tokens saved by cache hits."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped_by_policy": self.skipped_by_policy,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_tokens": self.saved_tokens
+            }
+
+
+_augmentation_cache = None
+
+
+def get_augmentation_cache(**kwargs) -> AugmentationCache:
+    """Return the process-wide agent2 augmentation cache, creating it on first use."""
+    global _augmentation_cache
+    with _cache_lock:
+        if _augmentation_cache is None:
+            _augmentation_cache = AugmentationCache(**kwargs)
+        return _augmentation_cache
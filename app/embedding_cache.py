@@ -0,0 +1,156 @@
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = "../data/embedding_cache/embeddings.sqlite"
+DEFAULT_MAX_ENTRIES = 5000
+
+
+# Words that end like plurals but are not, and must keep their final "s"
+_PLURAL_EXCEPTIONS = {"molasses", "hummus", "couscous", "asparagus", "citrus", "swiss", "series"}
+
+
+def singularize(token: str) -> str:
+    """
+    Conservatively fold an English plural to its singular. Only tokens of at least
+    4 letters are folded, words ending in "ss"/"us"/"is" and known exceptions are
+    left alone, and "es" is only dropped after x, z, ch, sh and o ("tomatoes",
+    "peaches"); otherwise a single trailing "s" is dropped ("eggs", "pies").
+    """
+    if (len(token) < 4 or not token.endswith("s") or token in _PLURAL_EXCEPTIONS
+            or token.endswith(("ss", "us", "is"))):
+        return token
+    if token.endswith(("xes", "zes", "ches", "shes", "oes")):
+        return token[:-2]
+    return token[:-1]
+
+
+def canonicalize(text: str) -> str:
+    """
+    Normalize an ingredient string so spellings differing only in case, spacing or
+    plural form ("Avocados" / "avocado") share a cache entry.
+    """
+    return " ".join(singularize(token) for token in text.strip().lower().split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk-backed, size-bounded LRU cache in front of another embeddings model.
+
+    Entries are keyed by model name and canonicalized text and stored in SQLite,
+    so they survive restarts and are shared by every session of the process. Meant
+    for query-time ingredient embeddings; index documents are embedded directly.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache_path: str = DEFAULT_CACHE_PATH,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def embed_documents(self, texts: list) -> list:
+        """Embed a list of texts, only calling the wrapped model for cache misses."""
+        keys = [canonicalize(text) for text in texts]
+        cached = self._get_many(set(keys))
+
+        # Embed each missing key once, using the first original spelling seen
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_entries = dict(zip(missing.keys(), vectors))
+            self._put_many(new_entries)
+            cached.update(new_entries)
+
+        miss_count = sum(1 for key in keys if key in missing)
+        with self._lock:
+            self.misses += miss_count
+            self.hits += len(keys) - miss_count
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        """Embed a single query text through the cache."""
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current number of cached entries."""
+        with self._lock:
+            size = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model,)
+            ).fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": size,
+                "max_entries": self.max_entries
+            }
+
+    def _get_many(self, keys: set) -> dict:
+        if not keys:
+            return {}
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text, vector FROM embeddings WHERE model = ? AND text IN ({placeholders})",
+                    [self.model, *chunk]
+                ).fetchall()
+                for text, blob in rows:
+                    found[text] = array("d", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text = ?",
+                    [(now, self.model, text) for text in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _put_many(self, entries: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(self.model, text, array("d", vector).tobytes(), now) for text, vector in entries.items()]
+            )
+            # Evict least recently used entries beyond the size bound
+            self._conn.execute(
+                """
+                DELETE FROM embeddings WHERE model = ? AND rowid NOT IN (
+                    SELECT rowid FROM embeddings WHERE model = ? ORDER BY last_used DESC LIMIT ?
+                )
+                """,
+                (self.model, self.model, self.max_entries)
+            )
+            self._conn.commit()
@@ -0,0 +1,93 @@
+import json
+import re
+
+from embedding_cache import canonicalize
+
+DEFAULT_MIN_SCORE = 0.9
+
+
+def normalize_description(text: str) -> str:
+    """
+    Reduce a food description to a canonical, order-independent key, so that
+    "raw salmon" and the USDA style "Salmon, raw" map to the same string.
+    """
+    tokens = canonicalize(re.sub(r"[^\w\s]", " ", text)).split()
+    return " ".join(sorted(set(tokens)))
+
+
+class LexicalIndex:
+    """
+    In-memory lexical index over USDA food descriptions.
+
+    Lookups first try an exact hash match on the normalized description, then a
+    whole-word match: a description is only a candidate if it contains every query
+    token (plurals are folded by canonicalize), and it scores the share of its tokens
+    the query covers. Character-level similarity is never used, because qualifiers
+    such as "unsalted" or "nonfat" differ from their opposite by only a few letters.
+    No embedding call is needed either way.
+    """
+
+    def __init__(self, descriptions: list, metadatas: list):
+        self.descriptions = descriptions
+        self.metadatas = metadatas
+        self.keys = [normalize_description(description) for description in descriptions]
+
+        self._token_counts = [len(key.split()) for key in self.keys]
+
+        self._exact = {}
+        self._token_postings = {}
+        for i, key in enumerate(self.keys):
+            # Keep the first occurrence of duplicated descriptions
+            self._exact.setdefault(key, i)
+            for token in key.split():
+                self._token_postings.setdefault(token, []).append(i)
+
+    @classmethod
+    def from_chroma(cls, db):
+        """Build the index from every document already stored in a Chroma vector store."""
+        records = db._collection.get(include=["documents", "metadatas"])
+        return cls(records["documents"], [metadata or {} for metadata in records["metadatas"]])
+
+    @classmethod
+    def from_json(cls, filtered_db_path: str):
+        """Build the index from the filtered USDA JSON produced by preprocess.process_food_db."""
+        with open(filtered_db_path, 'r') as file:
+            json_data = json.load(file)
+        descriptions = [item.get("description", "") for item in json_data]
+        metadatas = [{k: v for k, v in item.items() if k != "description"} for item in json_data]
+        return cls(descriptions, metadatas)
+
+    def lookup(self, ingredient: str, min_score: float = DEFAULT_MIN_SCORE):
+        """
+        Return the best lexical match for an ingredient, or None if no description
+        scores at least min_score (0-1).
+        """
+        key = normalize_description(ingredient)
+        if not key:
+            return None
+
+        if key in self._exact:
+            return self._match(self._exact[key], 1.0)
+
+        # Every query word must appear in the description, so "unsalted butter"
+        # can never match "Butter, salted"
+        tokens = key.split()
+        postings = [self._token_postings.get(token) for token in tokens]
+        if not all(postings):
+            return None
+        candidates = set(postings[0]).intersection(*postings[1:])
+        if not candidates:
+            return None
+        # Fewest extra words wins, ties go to the first occurrence
+        best = min(candidates, key=lambda i: (self._token_counts[i], i))
+        score = len(tokens) / self._token_counts[best]
+        if score < min_score:
+            return None
+        return self._match(best, score)
+
+    def _match(self, i: int, score: float) -> dict:
+        return {
+            "description": self.descriptions[i],
+            "metadata": self.metadatas[i],
+            "score": score
+        }
@@ -0,0 +1,60 @@
+import hashlib
+import io
+
+from PIL import Image
+
+from mongodb import MIGRATION_BATCH_SIZE, MongoDB
+from preprocess import upload_image_bytes
+
+
+def store_history_image(image_bytes: bytes) -> str:
+    """
+    Upload an image from an embedded food_history entry under a content-addressed key,
+    so re-running an interrupted migration overwrites instead of duplicating it.
+    """
+    try:
+        image_format = (Image.open(io.BytesIO(image_bytes)).format or "jpeg").lower()
+    except Exception:
+        image_format = "jpeg"
+    key = f"history/{hashlib.sha256(image_bytes).hexdigest()}.{image_format}"
+    return upload_image_bytes(image_bytes, key, f"image/{image_format}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MongoDB maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate-meals", help="Move embedded food_history entries into the meals collection")
+    migrate_parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    subparsers.add_parser("ensure-indexes", help="Create all collection indexes")
+    nutrition_parser = subparsers.add_parser("migrate-nutrition", help="Convert stored nutrition info to the numeric schema")
+    nutrition_parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    backfill_parser = subparsers.add_parser("backfill-rollups", help="Recompute daily nutrition rollups from the meals collection")
+    backfill_parser.add_argument("--email", help="Only backfill this user")
+    subparsers.add_parser("rebuild-rankings", help="Recompute the global ranking counters and rank buckets from the meals collection")
+    diagnose_parser = subparsers.add_parser("diagnose-queries", help="Explain per-page-load queries and report collection scans")
+    diagnose_parser.add_argument("--email", required=True, help="User whose queries are explained")
+    args = parser.parse_args()
+
+    if args.command == "migrate-meals":
+        migrated = MongoDB().migrate_food_history(store_history_image, batch_size=args.batch_size)
+        print(f"Migrated {migrated} meals")
+    elif args.command == "ensure-indexes":
+        # MongoDB() creates the indexes on first use in a process
+        MongoDB()
+        print("Indexes are in place")
+    elif args.command == "migrate-nutrition":
+        converted = MongoDB().migrate_nutrition_schema(batch_size=args.batch_size)
+        print(f"Converted {converted} meals")
+    elif args.command == "backfill-rollups":
+        MongoDB().backfill_daily_rollups(args.email)
+    elif args.command == "rebuild-rankings":
+        MongoDB().rebuild_rankings()
+    elif args.command == "diagnose-queries":
+        report = MongoDB().diagnose_queries(args.email)
+        for entry in report:
+            flag = "COLLSCAN" if entry["collscan"] else "ok"
+            print(f"[{flag}] {entry['query']}: {' <- '.join(entry['stages'])}")
+        if any(entry["collscan"] for entry in report):
+            raise SystemExit(1)
@@ -1,10 +1,182 @@
 # mongodb.py
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+import bson
 import streamlit as st
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 import base64
+import functools
+import hashlib
 import secrets
+import threading
+
+from nutrition_parser import NUTRITION_SCHEMA_VERSION, normalize_nutrition_info
+
+# Meals returned per get_user_history page
+MEALS_PAGE_SIZE = 50
+# Embedded food_history entries moved per migration step
+MIGRATION_BATCH_SIZE = 100
+SESSION_LIFETIME = timedelta(days=30)
+# Users per global rankings page
+RANKINGS_PAGE_SIZE = 20
+# Ranking periods: all time plus calendar ISO week and month keys as "week:2025-W07", "month:2025-02"
+RANKING_PERIOD_FORMATS = {"week": "%G-W%V", "month": "%Y-%m"}
+
+# Projections: each method loads only the fields it needs, never meal history or images
+PROFILE_FIELDS = {"_id": 0, "email": 1, "name": 1, "picture": 1}
+FRIENDS_FIELDS = {"_id": 0, "friend_list": 1}
+
+# Indexes are created once per process, not on every MongoDB() instantiation
+_indexes_ensured = False
+# Multi-document transactions need a replica set or sharded cluster; a standalone
+# mongod rejects them. Detected from the client's topology once per process.
+_TRANSACTION_TOPOLOGIES = {"ReplicaSetWithPrimary", "Sharded", "LoadBalanced"}
+_transactions_supported = None
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """Profile fields of a user; session_token is set when a session was just started"""
+    email: str
+    name: str = "Unknown"
+    picture: str = ""
+    session_token: str = None
+
+    @classmethod
+    def from_document(cls, document, session_token=None):
+        return cls(
+            email=document["email"],
+            name=document.get("name") or "Unknown",
+            picture=document.get("picture") or "",
+            session_token=session_token
+        )
+
+
+@dataclass(frozen=True)
+class LeaderboardEntry:
+    """One row of the friends leaderboard or the global rankings"""
+    name: str
+    email: str
+    picture: str
+    food_history_size: int
+
+
+class _TransferMonitor(monitoring.CommandListener):
+    """Counts BSON bytes sent and received by the commands run on the current thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def totals(self):
+        return getattr(self._local, "sent", 0), getattr(self._local, "received", 0)
+
+    def started(self, event):
+        self._local.sent = getattr(self._local, "sent", 0) + len(bson.encode(event.command))
+
+    def succeeded(self, event):
+        self._local.received = getattr(self._local, "received", 0) + len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+# Registered on the client only when [mongodb] DEBUG_TRANSFER is enabled in secrets
+_transfer_monitor = _TransferMonitor()
+
+
+def _transfer_debug_enabled():
+    return bool(st.secrets["mongodb"].get("DEBUG_TRANSFER", False))
+
+
+def _logs_transfer(method):
+    """In transfer debug mode, log the bytes a MongoDB method sent and received"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.debug_transfer:
+            return method(self, *args, **kwargs)
+        sent_before, received_before = _transfer_monitor.totals()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            sent, received = _transfer_monitor.totals()
+            print(f"MongoDB.{method.__name__}: sent {sent - sent_before} B, received {received - received_before} B")
+    return wrapper
+
+def ranking_periods(date):
+    """Keys of every ranking period a meal eaten at date counts towards"""
+    return ["all"] + [f"{kind}:{date.strftime(fmt)}" for kind, fmt in RANKING_PERIOD_FORMATS.items()]
+
+# Daily total column for each nutrient name agent3 reports
+DAILY_TOTAL_FIELDS = {"energy": "calories", "protein": "protein", "carbs": "carbs", "fat": "fat"}
+
+def _day_of(date):
+    """Midnight starting the day of date, the key of its daily rollup"""
+    return datetime.combine(date.date() if isinstance(date, datetime) else date, datetime.min.time())
+
+def nutrition_totals(final_nutrition_info):
+    """
+    Nutrient totals of one meal in the stored schema (see normalize_nutrition_info) as
+    {"calories", "protein", "carbs", "fat"}, counting each range as the average of min and max.
+    """
+    totals = dict.fromkeys(DAILY_TOTAL_FIELDS.values(), 0.0)
+    for item in final_nutrition_info:
+        totals[DAILY_TOTAL_FIELDS[item["nutrient"]]] += (item["min"] + item["max"]) / 2
+    return totals
+
+def _daily_totals_pipeline(match):
+    # Groups matching meals into {"_id": {"email", "day"}, "meal_count", <DAILY_TOTAL_FIELDS>}
+    return [
+        {"$match": match},
+        {"$project": {
+            "email": 1,
+            "day": {"$dateTrunc": {"date": "$date", "unit": "day"}},
+            "final_nutrition_info": 1
+        }},
+        # Meals without nutrition info are kept so they still count as a meal
+        {"$unwind": {"path": "$final_nutrition_info", "preserveNullAndEmptyArrays": True}},
+        {"$group": {
+            "_id": {"meal": "$_id", "email": "$email", "day": "$day"},
+            **{
+                field: {"$sum": {"$cond": [
+                    {"$eq": ["$final_nutrition_info.nutrient", nutrient]},
+                    {"$avg": ["$final_nutrition_info.min", "$final_nutrition_info.max"]},
+                    0
+                ]}}
+                for nutrient, field in DAILY_TOTAL_FIELDS.items()
+            }
+        }},
+        {"$group": {
+            "_id": {"email": "$_id.email", "day": "$_id.day"},
+            "meal_count": {"$sum": 1},
+            **{field: {"$sum": f"${field}"} for field in DAILY_TOTAL_FIELDS.values()}
+        }}
+    ]
+
+def _nutrition_fields(final_nutrition_info):
+    # Stored nutrition fields of a legacy meal; unconvertible values are kept for inspection
+    try:
+        return {
+            "final_nutrition_info": normalize_nutrition_info(final_nutrition_info),
+            "schema_version": NUTRITION_SCHEMA_VERSION
+        }
+    except ValueError:
+        return {
+            "final_nutrition_info": [],
+            "raw_final_nutrition_info": final_nutrition_info,
+            "schema_version": NUTRITION_SCHEMA_VERSION
+        }
+
+def _plan_stages(plan):
+    # Newer servers nest the classic plan tree under "queryPlan"
+    plan = plan.get("queryPlan", plan)
+    stages = [plan["stage"]] if "stage" in plan else []
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = [plan["inputStage"]]
+    for child in children:
+        stages.extend(_plan_stages(child))
+    return stages
 
 class MongoDB:
     def __init__(self):
@@ -20,7 +192,8 @@ class MongoDB:
                     serverSelectionTimeoutMS=5000,
                     connectTimeoutMS=10000,
                     socketTimeoutMS=None,
-                    connect=True
+                    connect=True,
+                    event_listeners=[_transfer_monitor] if _transfer_debug_enabled() else []
                 )
                 
                 # Test the connection
@@ -32,8 +205,51 @@ class MongoDB:
                 raise Exception("Failed to connect to MongoDB")
         
         self.client = st.session_state.mongodb_client
+        self.debug_transfer = _transfer_debug_enabled()
         self.db = self.client.food_ai_db
         self.users = self.db.users
+        # One document per saved analysis, images live in S3 and are referenced by key
+        self.meals = self.db.meals
+        # One login session per user, removed by a TTL index once expired
+        self.sessions = self.db.sessions
+        # Meal counters per (email, period), incremented on every save
+        self.rankings = self.db.rankings
+        # Number of users per (period, meal count), kept in step with rankings so
+        # "my rank" sums a few buckets instead of counting every user ahead
+        self.ranking_buckets = self.db.ranking_buckets
+        # Nutrition sums and meal count per (email, day), incremented on every save
+        self.daily_rollups = self.db.daily_rollups
+
+        global _indexes_ensured
+        if not _indexes_ensured:
+            self.ensure_indexes()
+            _indexes_ensured = True
+
+    def ensure_indexes(self):
+        """Create the indexes the queries below rely on (no-op if they already exist)"""
+        try:
+            self.users.create_index("email", unique=True)
+        except OperationFailure as e:
+            # Existing duplicate emails must be merged by hand before the constraint holds
+            print(f"Could not create unique email index: {e}")
+            self.users.create_index("email")
+        # Reverse friend lookups: users who have a given email in their friend_list
+        self.users.create_index([("friend_list.email", ASCENDING), ("friend_list.status", ASCENDING)])
+
+        self.sessions.create_index("session_token", unique=True)
+        self.sessions.create_index("email", unique=True)
+        self.sessions.create_index("expires_at", expireAfterSeconds=0)
+
+        self.meals.create_index([("email", ASCENDING), ("date", DESCENDING)])
+        self.rankings.create_index([("email", ASCENDING), ("period", ASCENDING)], unique=True)
+        self.daily_rollups.create_index([("email", ASCENDING), ("day", ASCENDING)], unique=True)
+        # Serves top-N pages for a period straight from the index
+        self.rankings.create_index([("period", ASCENDING), ("count", DESCENDING), ("email", ASCENDING)])
+        self.ranking_buckets.create_index([("period", ASCENDING), ("count", DESCENDING)], unique=True)
+        # Lets the food_history migration upsert the same entry twice without duplicating it
+        self.meals.create_index(
+            "legacy_key", unique=True, partialFilterExpression={"legacy_key": {"$exists": True}}
+        )
 
     def __enter__(self):
         return self
@@ -42,107 +258,489 @@ class MongoDB:
         # Don't close the connection here anymore since we're reusing it
         pass
 
-    def save_analysis(self, email, image_data, ingredients, final_nutrition_info, text_summary):
-        """Save food analysis with image, ingredients, nutrition info, and summary"""
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
-        
-        analysis_entry = {
+    def supports_transactions(self):
+        """True if the deployment is a replica set or sharded cluster, which transactions require"""
+        global _transactions_supported
+        if _transactions_supported is None:
+            if self.client.topology_description.topology_type_name == "Unknown":
+                # Not connected yet, a round trip discovers the topology
+                self.client.admin.command("ping")
+            _transactions_supported = (
+                self.client.topology_description.topology_type_name in _TRANSACTION_TOPOLOGIES
+            )
+            if not _transactions_supported:
+                print("MongoDB is a standalone server, meals are saved without transactions")
+        return _transactions_supported
+
+    @_logs_transfer
+    def save_analysis(self, email, image_key, ingredients, final_nutrition_info, text_summary):
+        """
+        Save food analysis as a meal document referencing the S3 image by key.
+        Nutrition info is stored as numeric ranges (raises ValueError if it is invalid).
+
+        On a replica set or sharded cluster the meal, its daily rollup and its ranking
+        counters are written in one transaction. A standalone mongod has no transactions,
+        so the writes are made in order instead: the meal first, then the counters. If
+        a counter update fails there, the meal stays saved and `python maintenance.py
+        backfill-rollups` / `rebuild-rankings` recompute the counters from the meals.
+        """
+        final_nutrition_info = normalize_nutrition_info(final_nutrition_info)
+        meal = {
+            "email": email,
             "date": datetime.now(),
-            "image": image_base64,
+            "image_key": image_key,
             "ingredients": ingredients,
             "final_nutrition_info": final_nutrition_info,
+            "schema_version": NUTRITION_SCHEMA_VERSION,
             "text_summary": text_summary
         }
-        
-        self.users.update_one(
-            {"email": email},
-            {"$push": {"food_history": analysis_entry}},
-            upsert=True
+        totals = nutrition_totals(final_nutrition_info)
+
+        def write_counters(session):
+            self.daily_rollups.update_one(
+                {"email": email, "day": _day_of(meal["date"])},
+                {"$inc": {"meal_count": 1, **totals}},
+                upsert=True,
+                session=session
+            )
+            # Each counter moves from count - 1 to count, and its user moves bucket with it
+            bucket_updates = []
+            for period in ranking_periods(meal["date"]):
+                counter = self.rankings.find_one_and_update(
+                    {"email": email, "period": period},
+                    {"$inc": {"count": 1}, "$set": {"updated_at": meal["date"]}},
+                    projection={"_id": 0, "count": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                    session=session
+                )
+                bucket_updates.append(UpdateOne(
+                    {"period": period, "count": counter["count"]}, {"$inc": {"users": 1}}, upsert=True
+                ))
+                if counter["count"] > 1:
+                    bucket_updates.append(UpdateOne(
+                        {"period": period, "count": counter["count"] - 1}, {"$inc": {"users": -1}}, upsert=True
+                    ))
+            self.ranking_buckets.bulk_write(bucket_updates, ordered=False, session=session)
+
+        def write_meal(session):
+            self.meals.insert_one(meal, session=session)
+            write_counters(session)
+
+        if self.supports_transactions():
+            # The meal, its daily rollup and ranking counters are written all or nothing
+            with self.client.start_session() as session:
+                session.with_transaction(write_meal)
+            return
+
+        self.meals.insert_one(meal)
+        try:
+            write_counters(None)
+        except PyMongoError as e:
+            # The meal is the source of truth; counters can be rebuilt from it
+            print(f"Meal saved but its rollup/ranking counters were not updated: {e}. "
+                  f"Run `python maintenance.py backfill-rollups --email {email}` and "
+                  f"`python maintenance.py rebuild-rankings` to repair them.")
+
+    @_logs_transfer
+    def get_user_history(self, email, page_size=MEALS_PAGE_SIZE, after=None, fields=None):
+        """
+        Get one page of a user's meals, newest first.
+        Pass the last meal of the previous page as after to get the next page, and a
+        list of field names as fields to load only those fields.
+        """
+        query = {"email": email}
+        if after is not None:
+            # Keyset paging on (date, _id) stays an index range scan at any depth
+            query["$or"] = [
+                {"date": {"$lt": after["date"]}},
+                {"date": after["date"], "_id": {"$lt": after["_id"]}}
+            ]
+        projection = dict.fromkeys(["date", *fields], 1) if fields else None
+        cursor = self.meals.find(query, projection).sort([("date", DESCENDING), ("_id", DESCENDING)])
+        return list(cursor.limit(page_size))
+
+    def iter_user_history(self, email, page_size=MEALS_PAGE_SIZE, fields=None):
+        """Iterate over all of a user's meals, newest first, one page at a time"""
+        after = None
+        while True:
+            page = self.get_user_history(email, page_size=page_size, after=after, fields=fields)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]
+
+    @_logs_transfer
+    def get_meals_between(self, email, start, end, fields=None):
+        """Get a user's meals with start <= date < end, oldest first"""
+        projection = dict.fromkeys(["date", *fields], 1) if fields else None
+        cursor = self.meals.find({"email": email, "date": {"$gte": start, "$lt": end}}, projection)
+        return list(cursor.sort([("date", ASCENDING), ("_id", ASCENDING)]))
+
+    @_logs_transfer
+    def count_meals(self, email):
+        """Number of meals a user has saved"""
+        return self.meals.count_documents({"email": email})
+
+    @_logs_transfer
+    def get_daily_totals(self, email, start, end):
+        """
+        Get per-day nutrition totals of a user's meals with start <= date < end from the
+        daily_rollups collection, reading one small document per day. Ranges count as the
+        average of min and max. Returns a list of
+        {"date", "calories", "protein", "carbs", "fat", "meal_count"} sorted by date.
+        """
+        rollups = self.daily_rollups.find(
+            {"email": email, "day": {"$gte": _day_of(start), "$lt": end}},
+            {"_id": 0, "day": 1, "meal_count": 1, **dict.fromkeys(DAILY_TOTAL_FIELDS.values(), 1)}
+        ).sort("day", ASCENDING)
+        return [
+            {
+                "date": rollup["day"].date(),
+                "meal_count": rollup.get("meal_count", 0),
+                **{field: rollup.get(field, 0.0) for field in DAILY_TOTAL_FIELDS.values()}
+            }
+            for rollup in rollups
+        ]
+
+    def backfill_daily_rollups(self, email=None):
+        """
+        Recompute daily_rollups from the meals collection (for one user, or everyone) with
+        a server-side aggregation. Rollups are replaced per (email, day); run it while few
+        meals are being saved, since a save racing the merge can be overwritten.
+        """
+        match = {"email": email} if email else {}
+        if self.meals.find_one({**match, "schema_version": {"$ne": NUTRITION_SCHEMA_VERSION}}, {"_id": 1}):
+            raise RuntimeError("Meals with an old nutrition schema exist, run migrate-nutrition first")
+        self.meals.aggregate(_daily_totals_pipeline(match) + [
+            {"$project": {
+                "_id": 0, "email": "$_id.email", "day": "$_id.day", "meal_count": 1,
+                **dict.fromkeys(DAILY_TOTAL_FIELDS.values(), 1)
+            }},
+            {"$merge": {"into": "daily_rollups", "on": ["email", "day"], "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ])
+        print(f"Backfilled daily rollups for {email or 'all users'}")
+
+    @_logs_transfer
+    def get_leaderboard(self, email):
+        """
+        Get the user and their confirmed friends with their meal counts in one aggregation,
+        sorted by meal count (descending). Only profile fields are loaded, never meals
+        or images. Returns a list of LeaderboardEntry.
+        """
+        pipeline = [
+            {"$match": {"email": email}},
+            {"$project": {
+                "members": {"$concatArrays": [["$email"], {"$map": {
+                    # Confirmed friends and legacy entries stored as plain email strings
+                    "input": {"$filter": {
+                        "input": {"$ifNull": ["$friend_list", []]},
+                        "as": "friend",
+                        "cond": {"$or": [
+                            {"$eq": [{"$type": "$$friend"}, "string"]},
+                            {"$eq": ["$$friend.status", 1]}
+                        ]}
+                    }},
+                    "as": "friend",
+                    "in": {"$cond": [{"$eq": [{"$type": "$$friend"}, "string"]}, "$$friend", "$$friend.email"]}
+                }}]}
+            }},
+            {"$lookup": {
+                "from": "users",
+                "localField": "members",
+                "foreignField": "email",
+                "pipeline": [{"$project": PROFILE_FIELDS}],
+                "as": "profiles"
+            }},
+            {"$lookup": {
+                "from": "meals",
+                "localField": "members",
+                "foreignField": "email",
+                "pipeline": [{"$group": {"_id": "$email", "count": {"$sum": 1}}}],
+                "as": "meal_counts"
+            }},
+            {"$project": {"_id": 0, "members": 1, "profiles": 1, "meal_counts": 1}}
+        ]
+        result = next(self.users.aggregate(pipeline), None)
+        if result is None:
+            return []
+
+        profiles = {profile["email"]: profile for profile in result["profiles"]}
+        counts = {entry["_id"]: entry["count"] for entry in result["meal_counts"]}
+        leaderboard = []
+        for member in dict.fromkeys(result["members"]):
+            profile = profiles.get(member, {})
+            leaderboard.append(LeaderboardEntry(
+                name=profile.get("name", "Unknown"),
+                email=member,
+                picture=profile.get("picture", ""),
+                food_history_size=counts.get(member, 0)
+            ))
+        return sorted(leaderboard, key=lambda entry: entry.food_history_size, reverse=True)
+
+    @_logs_transfer
+    def get_rankings(self, period="all", page_size=RANKINGS_PAGE_SIZE, after=None):
+        """
+        Get one page of the global ranking for a period ("all" or a ranking_periods key),
+        highest meal count first. Pass the last entry of the previous page as after to get
+        the next page. Returns a list of LeaderboardEntry.
+        """
+        query = {"period": period}
+        if after is not None:
+            # Keyset paging on (count desc, email asc) keeps every page an index range scan
+            query["$or"] = [
+                {"count": {"$lt": after.food_history_size}},
+                {"count": after.food_history_size, "email": {"$gt": after.email}}
+            ]
+        counters = list(
+            self.rankings.find(query, {"_id": 0, "email": 1, "count": 1})
+            .sort([("count", DESCENDING), ("email", ASCENDING)])
+            .limit(page_size)
         )
+        emails = [counter["email"] for counter in counters]
+        profiles = {
+            profile["email"]: profile
+            for profile in self.users.find({"email": {"$in": emails}}, PROFILE_FIELDS)
+        }
+        return [
+            LeaderboardEntry(
+                name=profiles.get(counter["email"], {}).get("name", "Unknown"),
+                email=counter["email"],
+                picture=profiles.get(counter["email"], {}).get("picture", ""),
+                food_history_size=counter["count"]
+            )
+            for counter in counters
+        ]
 
-    def get_user_history(self, email):
-        """Get all food analysis history for a user"""
-        user = self.users.find_one({"email": email})
-        if user and "food_history" in user:
-            return user["food_history"]
-        return []
+    @_logs_transfer
+    def get_my_rank(self, email, period="all"):
+        """
+        Get a user's rank and meal count for a period as {"rank", "food_history_size"}.
+        Users with equal counts share a rank; rank is None if the user has no meals in it.
+
+        The users ahead are summed from the ranking_buckets of higher meal counts, so the
+        cost is bounded by the number of distinct counts above the user (at most the top
+        count of the period), not by the number of users in it.
+        """
+        counter = self.rankings.find_one({"email": email, "period": period}, {"_id": 0, "count": 1})
+        if not counter:
+            return {"rank": None, "food_history_size": 0}
+        buckets_ahead = self.ranking_buckets.aggregate([
+            {"$match": {"period": period, "count": {"$gt": counter["count"]}}},
+            {"$group": {"_id": None, "users": {"$sum": "$users"}}}
+        ])
+        ahead = next(buckets_ahead, {"users": 0})["users"]
+        return {"rank": ahead + 1, "food_history_size": counter["count"]}
+
+    def rebuild_rankings(self):
+        """
+        Recompute every ranking counter from the meals collection. Counters are replaced
+        in place, so rankings stay readable during the rebuild; counters of periods that
+        no longer have meals are removed at the end, then the ranking buckets are
+        recomputed from the counters.
+        """
+        started_at = datetime.now()
+        period_keys = {"all": {"$literal": "all"}}
+        for kind, fmt in RANKING_PERIOD_FORMATS.items():
+            period_keys[kind] = {"$concat": [f"{kind}:", {"$dateToString": {"format": fmt, "date": "$date"}}]}
+        for kind, period_key in period_keys.items():
+            self.meals.aggregate([
+                {"$group": {"_id": {"email": "$email", "period": period_key}, "count": {"$sum": 1}}},
+                {"$project": {
+                    "_id": 0, "email": "$_id.email", "period": "$_id.period",
+                    "count": 1, "updated_at": {"$literal": started_at}
+                }},
+                {"$merge": {"into": "rankings", "on": ["email", "period"], "whenMatched": "replace", "whenNotMatched": "insert"}}
+            ])
+            print(f"Rebuilt {kind} rankings")
+        # Counters touched by the rebuild or by saves since it started are newer than this
+        removed = self.rankings.delete_many({"updated_at": {"$lt": started_at}}).deleted_count
+        print(f"Removed {removed} stale ranking counters")
+        self.rankings.aggregate([
+            {"$group": {"_id": {"period": "$period", "count": "$count"}, "users": {"$sum": 1}}},
+            {"$project": {"_id": 0, "period": "$_id.period", "count": "$_id.count", "users": 1}},
+            {"$out": "ranking_buckets"}
+        ])
+        print("Rebuilt ranking buckets")
+
+    def migrate_food_history(self, store_image, batch_size=MIGRATION_BATCH_SIZE):
+        """
+        Move the food_history arrays embedded in user documents into the meals collection.
+
+        Entries are moved batch_size at a time: each batch's images are handed to
+        store_image(image_bytes) -> key, the meals are upserted by a key derived from the
+        entry, and only then are the entries removed from the front of the array. An
+        interrupted run can simply be restarted; re-processed entries are not duplicated
+        as long as store_image is idempotent. Returns the number of entries moved.
+        """
+        migrated = 0
+        for user in self.users.find({"food_history.0": {"$exists": True}}, {"email": 1}):
+            email = user["email"]
+            while True:
+                doc = self.users.find_one({"email": email}, {"email": 1, "food_history": {"$slice": batch_size}})
+                entries = doc.get("food_history", []) if doc else []
+                if not entries:
+                    break
+
+                meals = [self._legacy_meal(email, entry, store_image) for entry in entries]
+                self.meals.bulk_write(
+                    [UpdateOne({"legacy_key": meal["legacy_key"]}, {"$setOnInsert": meal}, upsert=True) for meal in meals],
+                    ordered=False
+                )
+                # Drop exactly the migrated entries from the front of the array
+                self.users.update_one(
+                    {"email": email},
+                    [{"$set": {"food_history": {"$slice": [
+                        "$food_history", len(entries), {"$max": [{"$size": "$food_history"}, 1]}
+                    ]}}}]
+                )
+                migrated += len(entries)
+                print(f"Migrated {len(entries)} meals of {email} ({migrated} total)")
+
+            self.users.update_one({"email": email, "food_history": {"$size": 0}}, {"$unset": {"food_history": ""}})
+        return migrated
+
+    @staticmethod
+    def _legacy_meal(email, entry, store_image):
+        date = entry.get("date")
+        if isinstance(date, str):
+            date = datetime.fromisoformat(date)
+        image_base64 = entry.get("image")
+        image_bytes = base64.b64decode(image_base64) if image_base64 else b""
+        image_key = store_image(image_bytes) if image_bytes else None
+        legacy_key = hashlib.sha256(
+            f"{email}|{date.isoformat() if date else ''}|{hashlib.sha256(image_bytes).hexdigest()}".encode('utf-8')
+        ).hexdigest()
+        return {
+            "email": email,
+            "date": date,
+            "image_key": image_key,
+            "ingredients": entry.get("ingredients", []),
+            **_nutrition_fields(entry.get("final_nutrition_info")),
+            "text_summary": entry.get("text_summary"),
+            "legacy_key": legacy_key
+        }
+
+    def migrate_nutrition_schema(self, batch_size=MIGRATION_BATCH_SIZE):
+        """
+        Convert the final_nutrition_info of meals saved before the numeric schema, batch_size
+        meals at a time. Converted meals are tagged with the schema version, so an
+        interrupted run resumes where it stopped. Values that cannot be converted are kept
+        under raw_final_nutrition_info. Returns the number of meals converted.
+        """
+        converted = 0
+        query = {"schema_version": {"$ne": NUTRITION_SCHEMA_VERSION}}
+        while True:
+            meals = list(self.meals.find(query, {"final_nutrition_info": 1}).limit(batch_size))
+            if not meals:
+                return converted
+            self.meals.bulk_write([
+                UpdateOne({"_id": meal["_id"]}, {"$set": _nutrition_fields(meal.get("final_nutrition_info"))})
+                for meal in meals
+            ], ordered=False)
+            converted += len(meals)
+            print(f"Converted {converted} meals to nutrition schema v{NUTRITION_SCHEMA_VERSION}")
 
+    @_logs_transfer
     def create_or_get_user(self, google_user):
-        """Create a new user or get existing user after Google authentication"""
+        """
+        Create a new user or get existing user after Google authentication.
+        Returns the UserProfile with the token of a newly started session.
+        """
         try:
-            user = self.users.find_one({"email": google_user["email"]})
+            user = self.users.find_one({"email": google_user["email"]}, PROFILE_FIELDS)
             
             if not user:
-                # Generate a session token
-                session_token = secrets.token_urlsafe(32)
-                user_data = {
+                user = {
                     "email": google_user["email"],
                     "name": google_user["name"],
                     "picture": google_user.get("picture", ""),
                     "created_at": datetime.now(),
-                    "food_history": [],
-                    "friend_list": [],
-                    "session_token": session_token,
-                    "session_expiry": datetime.now() + timedelta(days=30)
+                    "friend_list": []
                 }
-                self.users.insert_one(user_data)
-                return user_data
+                self.users.insert_one(user)
             
-            # Update existing user's session
-            session_token = secrets.token_urlsafe(32)
-            self.users.update_one(
-                {"email": google_user["email"]},
-                {
-                    "$set": {
-                        "session_token": session_token,
-                        "session_expiry": datetime.now() + timedelta(days=30)
-                    }
-                }
-            )
-            user["session_token"] = session_token
-            return user
+            # Start a new session, replacing the user's previous one
+            return UserProfile.from_document(user, session_token=self._start_session(google_user["email"]))
             
         except Exception as e:
             raise ConnectionFailure(f"Failed to create or get user: {e}")
 
+    def _start_session(self, email):
+        session_token = secrets.token_urlsafe(32)
+        self.sessions.replace_one(
+            {"email": email},
+            {
+                "email": email,
+                "session_token": session_token,
+                "expires_at": datetime.now() + SESSION_LIFETIME
+            },
+            upsert=True
+        )
+        return session_token
+
+    @_logs_transfer
     def verify_session(self, session_token):
-        """Verify if a session token is valid and return the user"""
+        """Verify if a session token is valid and return the user's UserProfile"""
         if not session_token:
             return None
-            
-        user = self.users.find_one({
+
+        # The TTL monitor runs about once a minute, so expiry is still checked here
+        session = self.sessions.find_one({
             "session_token": session_token,
-            "session_expiry": {"$gt": datetime.now()}
-        })
-        return user
+            "expires_at": {"$gt": datetime.now()}
+        }, {"_id": 0, "email": 1})
+        if not session:
+            return None
+        user = self.users.find_one({"email": session["email"]}, PROFILE_FIELDS)
+        return UserProfile.from_document(user) if user else None
 
+    @_logs_transfer
     def invalidate_session(self, email):
         """Invalidate a user's session"""
-        self.users.update_one(
-            {"email": email},
-            {
-                "$unset": {
-                    "session_token": "",
-                    "session_expiry": ""
-                }
-            }
-        )
+        self.sessions.delete_one({"email": email})
+
+    def diagnose_queries(self, email):
+        """
+        Explain the queries run on every page load for a given user and report the
+        stages of each winning plan. Returns a list of {"query", "stages", "collscan"}.
+        """
+        session = self.sessions.find_one({"email": email}, {"session_token": 1}) or {}
+        queries = {
+            "user by email": (self.users, {"email": email}),
+            "session by token": (self.sessions, {
+                "session_token": session.get("session_token", ""), "expires_at": {"$gt": datetime.now()}
+            }),
+            "friends of user": (self.users, {"friend_list.email": email, "friend_list.status": 1}),
+            "meal history page": (self.meals, {"email": email}),
+        }
+        report = []
+        for name, (collection, query) in queries.items():
+            cursor = collection.find(query)
+            if collection is self.meals:
+                cursor = cursor.sort([("date", DESCENDING), ("_id", DESCENDING)]).limit(MEALS_PAGE_SIZE)
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+            stages = _plan_stages(plan)
+            report.append({"query": name, "stages": stages, "collscan": "COLLSCAN" in stages})
+        return report
 
     # --- New Friend Ecosystem Methods ---
+    @_logs_transfer
     def send_friend_request(self, sender_email, target_email):
         """
         Send a friend request from sender_email to target_email.
         The target user's friend_list will receive an entry with status 0 (pending).
         """
-        target_user = self.users.find_one({"email": target_email})
+        target_user = self.users.find_one({"email": target_email}, {"_id": 1})
         if not target_user:
             return {"status": "error", "message": "Target user not found"}
 
         # Check if there is already an entry for this sender in the target's friend_list.
+        # The positional projection returns only that entry.
         existing_entry = self.users.find_one({
             "email": target_email,
             "friend_list": {"$elemMatch": {"email": sender_email}}
-        })
+        }, {"_id": 0, "friend_list.$": 1})
         if existing_entry:
             for entry in existing_entry.get("friend_list", []):
                 if entry["email"] == sender_email:
@@ -159,12 +757,13 @@ class MongoDB:
         )
         return {"status": "success", "message": "Friend request sent"}
 
+    @_logs_transfer
     def get_pending_friend_requests(self, email):
         """
         Retrieve all pending friend requests (status 0) for a user.
         Returns a list of sender emails.
         """
-        user = self.users.find_one({"email": email})
+        user = self.users.find_one({"email": email}, FRIENDS_FIELDS)
         pending = []
         if user and "friend_list" in user:
             for entry in user["friend_list"]:
@@ -176,6 +775,7 @@ class MongoDB:
                     pass
         return pending
 
+    @_logs_transfer
     def approve_friend_request(self, user_email, requester_email):
         """
         Approve a pending friend request.
@@ -188,7 +788,7 @@ class MongoDB:
             {"$set": {"friend_list.$.status": 1}}
         )
         # Update the requester's friend_list: If an entry exists, set to 1; otherwise, add a confirmed entry.
-        requester_doc = self.users.find_one({"email": requester_email})
+        requester_doc = self.users.find_one({"email": requester_email}, FRIENDS_FIELDS)
         if requester_doc:
             exists = False
             for entry in requester_doc.get("friend_list", []):
@@ -206,6 +806,7 @@ class MongoDB:
                 )
         return {"status": "success", "message": "Friend request approved"}
 
+    @_logs_transfer
     def decline_friend_request(self, user_email, requester_email):
         """
         Decline a pending friend request.
@@ -217,6 +818,7 @@ class MongoDB:
         )
         return {"status": "success", "message": "Friend request declined"}
 
+    @_logs_transfer
     def delete_friend(self, user_email, friend_email):
         """
         Delete a confirmed friend relationship. This removes the friend entry from both users' friend_list.
@@ -235,12 +837,13 @@ class MongoDB:
         else:
             return {"status": "info", "message": "Friend not found in friend list"}
 
+    @_logs_transfer
     def get_friend_list(self, email):
         """
         Retrieve the confirmed friend list for a given user.
         Only entries with status 1 (if a dict) or legacy string entries are considered confirmed friends.
         """
-        user = self.users.find_one({"email": email})
+        user = self.users.find_one({"email": email}, FRIENDS_FIELDS)
         if user and "friend_list" in user:
             confirmed = []
             for entry in user["friend_list"]:
@@ -0,0 +1,141 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# USDA nutrient ids, in the column order used by the Home page nutrition table
+NUTRIENT_IDS = [1005, 1008, 1003, 1004]
+NUTRIENT_COLUMNS = ["Carbohydrate (g)", "Energy (kcal)", "Protein (g)", "Fat (g)"]
+
+VALUES_FILE = "nutrients.f32"
+DESCRIPTIONS_FILE = "descriptions.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+
+def nutrient_row(food_data) -> list:
+    """
+    Extract the tracked nutrient amounts of one USDA food item, in NUTRIENT_IDS order.
+    Missing nutrients are NaN.
+    """
+    amounts = {}
+    for nutrient in food_data["foodNutrients"]:
+        nutrient_id = nutrient["nutrient"]["id"]
+        if nutrient_id in NUTRIENT_IDS:
+            amounts[nutrient_id] = nutrient.get("amount")
+    return [float(amounts[i]) if amounts.get(i) is not None else float("nan") for i in NUTRIENT_IDS]
+
+
+class NutrientStoreWriter:
+    """
+    Append-only writer for the columnar nutrient store.
+
+    Values are written as a flat float32 row-major matrix (one row per food, one
+    column per nutrient) that can be memory-mapped, and descriptions are written as
+    JSON lines; the row number is the integer food index.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.count = 0
+        os.makedirs(store_dir, exist_ok=True)
+        # Rows go to temporary files that only replace the live store on a clean close
+        self._values = open(self._temp_path(VALUES_FILE), 'wb')
+        self._descriptions = open(self._temp_path(DESCRIPTIONS_FILE), 'w', encoding='utf-8')
+
+    def _temp_path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name + ".tmp")
+
+    def append(self, descriptions: list, rows: list):
+        """Append a batch of foods; rows are lists of nutrient values in NUTRIENT_IDS order."""
+        self._values.write(np.asarray(rows, dtype=np.float32).reshape(-1, len(NUTRIENT_IDS)).tobytes())
+        for description in descriptions:
+            self._descriptions.write(json.dumps(description) + "\n")
+        self.count += len(descriptions)
+
+    def close(self, commit: bool = True):
+        """
+        Close the store. On commit the data files are renamed into place and the
+        manifest is written last, so readers never see a manifest for partial data;
+        otherwise the temporary files are discarded and the previous store is kept.
+        """
+        self._values.close()
+        self._descriptions.close()
+        if not commit:
+            for name in (VALUES_FILE, DESCRIPTIONS_FILE):
+                if os.path.exists(self._temp_path(name)):
+                    os.remove(self._temp_path(name))
+            return
+
+        # Readers treat a store without a manifest as missing while the files are swapped
+        manifest_path = os.path.join(self.store_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        for name in (VALUES_FILE, DESCRIPTIONS_FILE):
+            os.replace(self._temp_path(name), os.path.join(self.store_dir, name))
+        manifest = {"nutrient_ids": NUTRIENT_IDS, "columns": NUTRIENT_COLUMNS, "count": self.count}
+        with open(self._temp_path(MANIFEST_FILE), 'w') as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(self._temp_path(MANIFEST_FILE), manifest_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(commit=exc_type is None)
+
+
+def write_nutrient_store(food_items, store_dir: str) -> int:
+    """
+    Write the columnar nutrient store for an iterable of USDA food items.
+    Returns the number of foods written.
+    """
+    with NutrientStoreWriter(store_dir) as writer:
+        for food_item in food_items:
+            writer.append([food_item["description"]], [nutrient_row(food_item)])
+    return writer.count
+
+
+class NutrientStore:
+    """
+    Read-only, memory-mapped view of the columnar nutrient store.
+
+    The value matrix is mapped rather than read, so every worker process opening
+    the same store shares the pages through the OS cache.
+    """
+
+    def __init__(self, values, descriptions: list):
+        self.values = values
+        self.descriptions = descriptions
+        self._index = {}
+        for i, description in enumerate(descriptions):
+            self._index.setdefault(description, i)
+
+    @classmethod
+    def load(cls, store_dir: str):
+        with open(os.path.join(store_dir, MANIFEST_FILE), 'r') as file:
+            manifest = json.load(file)
+        shape = (manifest["count"], len(manifest["nutrient_ids"]))
+        if manifest["count"] == 0:
+            # An empty file cannot be memory-mapped
+            values = np.empty(shape, dtype=np.float32)
+        else:
+            values = np.memmap(os.path.join(store_dir, VALUES_FILE), dtype=np.float32, mode='r', shape=shape)
+        with open(os.path.join(store_dir, DESCRIPTIONS_FILE), 'r', encoding='utf-8') as file:
+            descriptions = [json.loads(line) for line in file]
+        return cls(values, descriptions)
+
+    def index_of(self, description: str):
+        """Return the integer food index of a description, or None if unknown."""
+        return self._index.get(description)
+
+    def rows(self, indices) -> np.ndarray:
+        """Nutrient values (per 100g) for the given food indices, one row per index."""
+        return np.asarray(self.values[np.asarray(indices, dtype=np.int64)])
+
+    def to_frame(self, labels: list, indices) -> pd.DataFrame:
+        """Build the per-ingredient nutrition table for the given labels and food indices."""
+        # float64 and 2 decimals, so 12.3 survives the analysis cache's JSON round trip as 12.3
+        df = pd.DataFrame(self.rows(indices).astype("float64").round(2), columns=NUTRIENT_COLUMNS)
+        df.insert(0, "Ingredient", labels)
+        return df
@@ -0,0 +1,116 @@
+import re
+
+# Output order matches the format agent3 has always returned
+NUTRIENTS = ["energy", "protein", "fat", "carbs"]
+
+_NUTRIENT_LABELS = [
+    ("energy", re.compile(r"\b(energy|calories|kcal)\b", re.IGNORECASE)),
+    ("protein", re.compile(r"\bprotein\b", re.IGNORECASE)),
+    ("fat", re.compile(r"\b(fat|fats|lipids?)\b", re.IGNORECASE)),
+    ("carbs", re.compile(r"\b(carbohydrates?|carbs?)\b", re.IGNORECASE)),
+]
+# Rows for a part of a nutrient ("Saturated Fat", "Sugars", "Calories from fat") are not its total
+_SUB_NUTRIENT_LABEL = re.compile(
+    r"\b(saturated|trans|mono\w*|poly\w*|sugars?|fib(?:er|re)|dietary|from\s+fat)\b", re.IGNORECASE
+)
+_NUMBER = r"(\d[\d,]*(?:\.\d+)?)"
+_RANGE = re.compile(_NUMBER + r"\s*(?:kcal|g)?\s*(?:-|–|—|to)\s*" + _NUMBER, re.IGNORECASE)
+# A line holding only the Summary heading: "### Summary", "**Summary:**", "Summary"
+_SUMMARY_HEADING = re.compile(r"^\s*(?:#+\s*)?[*_]*\s*summary\s*:?\s*[*_]*\s*:?\s*$", re.IGNORECASE | re.MULTILINE)
+_HEADING = re.compile(r"^\s*#")
+_VALUE = re.compile(r"\s*" + _NUMBER + r"\s*(?:kcal|g)?\s*", re.IGNORECASE)
+
+# Version of the stored final_nutrition_info schema produced by normalize_nutrition_info
+NUTRITION_SCHEMA_VERSION = 2
+
+
+def _to_float(value: str) -> float:
+    return float(value.replace(",", ""))
+
+
+def _nutrient_of(label: str):
+    if _SUB_NUTRIENT_LABEL.search(label):
+        return None
+    for nutrient, pattern in _NUTRIENT_LABELS:
+        if pattern.search(label):
+            return nutrient
+    return None
+
+
+def parse_summary_table(agent2_response: str):
+    """
+    Extract the min/max ranges of the Summary table in agent2's response.
+
+    Handles markdown pipe tables, tab separated rows and "Label: value" lines, ranges
+    written as "493 - 611 kcal", "32-39g", "1,050 – 1,200 kcal" or "30 to 40 g".
+    Only the first table after the Summary heading line is read; it ends at the next
+    heading or at a blank line following its rows. Rows for sub-nutrients such as
+    "Saturated Fat" are skipped.
+    Returns the same list agent3 produces, or None if the Summary section is missing
+    or does not yield a valid range for every nutrient.
+    """
+    heading = _SUMMARY_HEADING.search(agent2_response or "")
+    if heading is None:
+        return None
+    summary = agent2_response[heading.end():]
+
+    ranges = {}
+    table_started = False
+    for line in summary.splitlines():
+        if _HEADING.match(line) or (table_started and not line.strip()):
+            break
+        cells = [cell.strip(" *_") for cell in re.split(r"\||\t|:", line) if cell.strip(" *_")]
+        if len(cells) < 2:
+            continue
+        nutrient = _nutrient_of(cells[0])
+        if nutrient is None or nutrient in ranges:
+            continue
+        match = _RANGE.search(" ".join(cells[1:]))
+        if match:
+            ranges[nutrient] = (_to_float(match.group(1)), _to_float(match.group(2)))
+            table_started = True
+
+    if set(ranges) != set(NUTRIENTS):
+        return None
+    if any(low < 0 or low > high for low, high in ranges.values()):
+        return None
+    return [{"nutrient": nutrient, "min": ranges[nutrient][0], "max": ranges[nutrient][1]} for nutrient in NUTRIENTS]
+
+
+def _value_to_float(value) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _VALUE.fullmatch(value) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"Not a nutrient amount: {value!r}")
+    return _to_float(match.group(1))
+
+
+def normalize_nutrition_info(final_nutrition_info) -> list:
+    """
+    Convert agent3 output into the stored nutrition schema: a list of
+    {"nutrient", "min", "max"} with float bounds, in NUTRIENTS order.
+
+    Accepts a list of ranges or a {nutrient: value} dict (stored as min == max), with
+    values given as numbers or strings such as "1,050" or "32 g". Unknown nutrients are
+    dropped. Raises ValueError if an amount is not a number or a range is invalid.
+    """
+    if isinstance(final_nutrition_info, list):
+        items = [
+            (item.get("nutrient"), item.get("min"), item.get("max"))
+            for item in final_nutrition_info if isinstance(item, dict)
+        ]
+    elif isinstance(final_nutrition_info, dict):
+        items = [(nutrient, value, value) for nutrient, value in final_nutrition_info.items()]
+    else:
+        raise ValueError(f"Unsupported nutrition info: {final_nutrition_info!r}")
+
+    ranges = {}
+    for nutrient, low, high in items:
+        if nutrient not in NUTRIENTS:
+            continue
+        low, high = _value_to_float(low), _value_to_float(high)
+        if low < 0 or low > high:
+            raise ValueError(f"Invalid {nutrient} range: {low} - {high}")
+        ranges[nutrient] = {"nutrient": nutrient, "min": low, "max": high}
+    return [ranges[nutrient] for nutrient in NUTRIENTS if nutrient in ranges]
@@ -1,5 +1,6 @@
 import streamlit as st
-from mongodb import MongoDB
+from datetime import datetime
+from mongodb import LeaderboardEntry, MongoDB, RANKINGS_PAGE_SIZE, ranking_periods
 from utils.session_manager import require_auth
 from utils.session_manager import get_authenticator
 from user import show_user_profile
@@ -19,28 +20,9 @@ require_auth()
 user = st.session_state["user"]
 user_email = user["email"]
 
-# Fetch user and friends' food history data
+# Fetch the user's and friends' meal counts in a single aggregation
 with MongoDB() as mongo:
-    # Get the current user's food history count
-    user_history = mongo.get_user_history(user_email)
-    user_food_count = len(user_history)
-
-    # Get the user's friends' list
-    user_data = mongo.create_or_get_user({"email": user_email, "name": user["name"], "picture": user.get("picture", "")})
-    friend_list = user_data.get("friend_list", [])
-
-    # Get all friends' food history count
-    friends_data = []
-    for friend in friend_list:
-        friend_email = friend["email"]
-        friend_history = mongo.get_user_history(friend_email)
-        friend_user = mongo.create_or_get_user({"email": friend_email, "name": "Unknown", "picture": ""})  # Ensure we get their name & pic
-        friends_data.append({
-            "name": friend_user.get("name", "Unknown"),
-            "email": friend_email,
-            "picture": friend_user.get("picture", ""),
-            "food_history_size": len(friend_history)
-        })
+    leaderboard = mongo.get_leaderboard(user_email)
     pending_requests = mongo.get_pending_friend_requests(user_email)
 
 
@@ -157,13 +139,9 @@ if st.session_state.active_popup == "confirmed_friends":
 
 # Leaderboard
 
-# Combine user and friends into one leaderboard list
-leaderboard = [
-    {"name": user["name"], "email": user_email, "picture": user.get("picture", ""), "food_history_size": user_food_count}
-] + friends_data
-
-# Sort by food history size (descending)
-leaderboard = sorted(leaderboard, key=lambda x: x["food_history_size"], reverse=True)
+# get_leaderboard already sorts by food history size (descending)
+if not leaderboard:
+    leaderboard = [LeaderboardEntry(name=user["name"], email=user_email, picture=user.get("picture", ""), food_history_size=0)]
 
 # Leaderboard Display in Table Format
 st.header("Rankings")
@@ -184,17 +162,58 @@ for idx, entry in enumerate(leaderboard):
 
     # Profile picture
     with col2:
-        if entry["picture"]:
-            st.image(entry["picture"], width=50)
+        if entry.picture:
+            st.image(entry.picture, width=50)
 
     # Name & Email
     with col3:
-        st.subheader(entry["name"])
-        st.write(f"📧 {entry['email']}")
+        st.subheader(entry.name)
+        st.write(f"📧 {entry.email}")
 
     # Food History Count
     with col4:
-        st.write(f"🍔 {entry['food_history_size']}")
+        st.write(f"🍔 {entry.food_history_size}")
 
 st.info("Leaderboard ranks users based on the number of food history records.")
 
+# Global rankings across all users, served from the incrementally maintained counters
+st.header("🌍 Global Rankings")
+
+period_options = dict(zip(["All time", "This week", "This month"], ranking_periods(datetime.now())))
+period_label = st.radio("Period", list(period_options), horizontal=True, key="global_ranking_period")
+period = period_options[period_label]
+
+# Keyset cursors of the pages visited so far, reset when the period changes
+if st.session_state.get("global_ranking_cursor_period") != period:
+    st.session_state.global_ranking_cursor_period = period
+    st.session_state.global_ranking_cursors = [None]
+cursors = st.session_state.global_ranking_cursors
+page_number = len(cursors) - 1
+
+with MongoDB() as mongo:
+    my_rank = mongo.get_my_rank(user_email, period)
+    global_page = mongo.get_rankings(period, after=cursors[-1])
+
+if my_rank["rank"] is not None:
+    st.metric("My Rank", f"#{my_rank['rank']}", f"🍔 {my_rank['food_history_size']} meals", delta_color="off")
+else:
+    st.write("You have no saved meals in this period yet.")
+
+for idx, entry in enumerate(global_page, start=page_number * RANKINGS_PAGE_SIZE):
+    col1, col2, col3 = st.columns([1, 3, 1])
+    with col1:
+        st.write(medals[idx] if idx < 3 else f"#{idx + 1}")
+    with col2:
+        st.write(f"**{entry.name}**")
+    with col3:
+        st.write(f"🍔 {entry.food_history_size}")
+
+prev_col, next_col = st.columns(2)
+with prev_col:
+    if page_number > 0 and st.button("⬅️ Previous", key="global_ranking_prev"):
+        cursors.pop()
+        st.rerun()
+with next_col:
+    if len(global_page) == RANKINGS_PAGE_SIZE and st.button("Next ➡️", key="global_ranking_next"):
+        cursors.append(global_page[-1])
+        st.rerun()
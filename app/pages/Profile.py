@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 import random
 from streamlit_calendar import calendar
 from mongodb import MongoDB
+from nutrition_parser import NUTRITION_SCHEMA_VERSION, normalize_nutrition_info
 import json
 from user import show_user_profile
 from utils.session_manager import get_authenticator
@@ -14,69 +15,36 @@ from utils.session_manager import get_authenticator
 
 authenticator = get_authenticator()
 
+# Day ranges offered for the nutrition charts
+HISTORY_DAYS_OPTIONS = [30, 90, 365]
+
 def show_profile():
     st.title("Nutrition Profile Dashboard")
     show_user_profile(authenticator)
 
-    def load_user_nutrition_history():
+    def load_user_nutrition_history(days):
         try:
             mongo = MongoDB()
             # Force a new MongoDB connection each time
             mongo.client.server_info()  # Test connection
-            user_data = mongo.users.find_one({"email": st.session_state['user_info'].get('email')})
-            food_history = user_data.get('food_history', []) if user_data else []
-            
-            # Add debug info
-            # st.write(f"Loading data at: {datetime.now()}")
-            # st.write(f"Number of food history entries: {len(food_history)}")
-            
-            # Process food history into daily totals
-            daily_totals = {}
-            for entry in food_history:
-                date = entry['date']
-                if isinstance(date, datetime):
-                    date_key = date.date()
-                else:
-                    date_key = datetime.fromisoformat(date).date()
-                
-                nutrition_info = entry.get('final_nutrition_info', [])
-                if not daily_totals.get(date_key):
-                    daily_totals[date_key] = {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0}
-                
-                # Handle both list and dict formats of nutrition_info
-                if isinstance(nutrition_info, list):
-                    for item in nutrition_info:
-                        nutrient = item.get('nutrient')
-                        # Use average of min and max values
-                        value = (float(str(item.get('min', 0)).replace(',', '')) + 
-                                float(str(item.get('max', 0)).replace(',', ''))) / 2
-                        if nutrient == 'energy':
-                            daily_totals[date_key]['calories'] += value
-                        elif nutrient in ['protein', 'carbs', 'fat']:
-                            daily_totals[date_key][nutrient] += value
-                elif isinstance(nutrition_info, dict):
-                    daily_totals[date_key]['calories'] += float(str(nutrition_info.get('energy', 0)).replace(',', ''))
-                    daily_totals[date_key]['protein'] += float(str(nutrition_info.get('protein', 0)).replace(',', ''))
-                    daily_totals[date_key]['carbs'] += float(str(nutrition_info.get('carbs', 0)).replace(',', ''))
-                    daily_totals[date_key]['fat'] += float(str(nutrition_info.get('fat', 0)).replace(',', ''))
+            # Daily totals are aggregated server-side; only one row per shown day is transferred
+            end = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+            daily_totals = mongo.get_daily_totals(
+                st.session_state['user_info'].get('email'), end - timedelta(days=days), end
+            )
             
             # Convert to DataFrame
-            df_data = {
-                'date': list(daily_totals.keys()),
-                'calories': [totals['calories'] for totals in daily_totals.values()],
-                'protein': [totals['protein'] for totals in daily_totals.values()],
-                'carbs': [totals['carbs'] for totals in daily_totals.values()],
-                'fat': [totals['fat'] for totals in daily_totals.values()]
-            }
-            df = pd.DataFrame(df_data)
-            df = df.sort_values('date')
+            df = pd.DataFrame(daily_totals, columns=['date', 'calories', 'protein', 'carbs', 'fat'])
             return df
         except Exception as e:
             st.error(f"Error loading nutrition history: {str(e)}")
             return pd.DataFrame(columns=['date', 'calories', 'protein', 'carbs', 'fat'])
 
     # Load user data
-    user_data = load_user_nutrition_history()
+    history_days = st.selectbox(
+        "Show history for", HISTORY_DAYS_OPTIONS, index=1, format_func=lambda days: f"Last {days} days"
+    )
+    user_data = load_user_nutrition_history(history_days)
 
     # Create dashboard layout
     col1, col2 = st.columns([2, 1])
@@ -177,8 +145,9 @@ def show_profile():
 
     try:
         mongo = MongoDB()
-        user_data = mongo.users.find_one({"email": st.session_state['user_info'].get('email')})
-        food_history = user_data.get('food_history', []) if user_data else []
+        email = st.session_state['user_info'].get('email')
+        # Only meal dates are needed for the calendar; details are loaded per selected day
+        food_history = mongo.iter_user_history(email, fields=['date'])
         
         # Group meals by date
         meals_by_date = {}
@@ -237,7 +206,11 @@ def show_profile():
             date = event_id.split('-meal-')[0]
             meal_index = int(event_id.split('-meal-')[1]) - 1
             
-            selected_meals = meals_by_date.get(date, [])
+            day_start = datetime.fromisoformat(date)
+            selected_meals = mongo.get_meals_between(
+                email, day_start, day_start + timedelta(days=1),
+                fields=['ingredients', 'final_nutrition_info', 'schema_version', 'text_summary']
+            ) if date in meals_by_date else []
             if selected_meals and meal_index < len(selected_meals):
                 selected_meal = selected_meals[meal_index]
                 # Add the date as a main title
@@ -276,6 +249,12 @@ def display_meal_details(entry):
     with col2:
         st.markdown("##### 📊 Detailed Nutrition")
         nutrition_info = entry.get('final_nutrition_info', [])
+        if entry.get('schema_version', 0) < NUTRITION_SCHEMA_VERSION:
+            # Saved before the numeric schema and not migrated yet
+            try:
+                nutrition_info = normalize_nutrition_info(nutrition_info)
+            except ValueError:
+                nutrition_info = []
         
         # Define nutrient display names and units
         nutrient_display = {
@@ -285,31 +264,12 @@ def display_meal_details(entry):
             "fat": ("Fat", "g")
         }
         
-        # Check if nutrition_info is a list
-        if isinstance(nutrition_info, list):
-            # Display each nutrient's range
-            for item in nutrition_info:
-                if isinstance(item, dict):  # Verify item is a dictionary
-                    nutrient = item.get('nutrient', '')
-                    if nutrient in nutrient_display:
-                        display_name, unit = nutrient_display[nutrient]
-                        min_val = float(str(item.get('min', 0)).replace(',', ''))
-                        max_val = float(str(item.get('max', 0)).replace(',', ''))
-                        st.markdown(
-                            f"**{display_name}:** {min_val:.1f} - {max_val:.1f} {unit}"
-                        )
-        elif isinstance(nutrition_info, dict):
-            # Handle case where nutrition_info is a dictionary
-            for nutrient, value in nutrition_info.items():
-                if nutrient in nutrient_display:
-                    display_name, unit = nutrient_display[nutrient]
-                    try:
-                        # Convert value to float, handling string values
-                        value = float(str(value).replace(',', ''))
-                        st.markdown(f"**{display_name}:** {value:.1f} {unit}")
-                    except (ValueError, TypeError):
-                        # If conversion fails, display the raw value
-                        st.markdown(f"**{display_name}:** {value} {unit}")
+        # Stored as numeric {"nutrient", "min", "max"} ranges
+        for item in nutrition_info:
+            display_name, unit = nutrient_display[item['nutrient']]
+            st.markdown(
+                f"**{display_name}:** {item['min']:.1f} - {item['max']:.1f} {unit}"
+            )
         
         # Add time information if available
         if isinstance(entry['date'], datetime):
@@ -0,0 +1,93 @@
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agents import agent1_food_image_caption, agent3_parse_nutrition, agent4_create_summary
+from preprocess import prepare_image, upload_image
+
+
+# Shared by all sessions for work that outlives a single script run
+_background_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="analysis")
+
+# Post-processing agents that only depend on agent2's output, by result key
+_POST_PROCESSING_AGENTS = {
+    "final_nutrition_info": agent3_parse_nutrition,
+    "text_summary": agent4_create_summary,
+}
+
+
+def timed(timings: dict, stage: str, fn, *args, **kwargs):
+    """Run fn and record its wall-clock duration (seconds) under timings[stage]."""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+
+def _caption_image(image_bytes: bytes, timings: dict):
+    # Downsized once here and reused by agent2
+    encoded_image, mime_type = timed(timings, "image_prep", prepare_image, io.BytesIO(image_bytes))
+    return agent1_food_image_caption(encoded_image, mime_type), encoded_image, mime_type
+
+
+def run_image_analysis(uploaded_file, warm_up=None):
+    """
+    Run the independent first-analysis stages concurrently: the S3 upload, the
+    agent1 ingredient extraction and (optionally) the vector DB warm-up.
+
+    The stages share no state, so end-to-end time approaches the slowest stage
+    instead of their sum. All stages are joined before returning so errors surface
+    to the caller. Returns (ingredients, encoded_image, mime_type, image_key, timings)
+    where the image is the downsized copy sent to the vision models, image_key is the
+    S3 key of the original upload and timings maps each stage, plus "total", to its
+    duration in seconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+    # Read the bytes once so no two threads move the same file position
+    image_bytes = uploaded_file.getvalue()
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        upload_future = pool.submit(timed, timings, "s3_upload", upload_image, uploaded_file)
+        caption_future = pool.submit(timed, timings, "agent1", _caption_image, image_bytes, timings)
+        warm_up_future = pool.submit(timed, timings, "vector_db_warm_up", warm_up) if warm_up else None
+
+        ingredients, encoded_image, mime_type = caption_future.result()
+        image_key = upload_future.result()
+        if warm_up_future is not None:
+            warm_up_future.result()
+
+    timings["total"] = time.perf_counter() - start
+    print(f"Analysis pipeline timings: {timings}")
+    return ingredients, encoded_image, mime_type, image_key, timings
+
+
+def start_post_processing(nutrition_augmentation: str) -> dict:
+    """
+    Start agent3 (nutrition parsing) and agent4 (summary) concurrently in the background.
+    Both only depend on agent2's output, so they can run speculatively as soon as it is
+    available. Returns {"final_nutrition_info": future, "text_summary": future}.
+    """
+    return {
+        key: _background_pool.submit(agent, nutrition_augmentation)
+        for key, agent in _POST_PROCESSING_AGENTS.items()
+    }
+
+
+def collect_post_processing(nutrition_augmentation: str, futures: dict = None):
+    """
+    Wait for the agent3/agent4 results started by start_post_processing, starting them
+    now if they were never started. A call that failed is retried once inline.
+    Returns (final_nutrition_info, text_summary).
+    """
+    if futures is None:
+        futures = start_post_processing(nutrition_augmentation)
+    results = {}
+    for key, future in futures.items():
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            print(f"Background {key} failed, retrying: {e}")
+            results[key] = _POST_PROCESSING_AGENTS[key](nutrition_augmentation)
+    return results["final_nutrition_info"], results["text_summary"]
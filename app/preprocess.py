@@ -3,6 +3,13 @@ import sys
 import pysqlite3
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 import json
+import csv
+import resource
+import textwrap
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import ijson
 import pandas as pd
 import base64
 from pathlib import Path
@@ -10,12 +17,15 @@ from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 import os
 from dotenv import load_dotenv
-from langchain_core.documents import Document
-from uuid import uuid4
+from nutrient_store import (DESCRIPTIONS_FILE, MANIFEST_FILE, VALUES_FILE, NutrientStoreWriter, nutrient_row,
+                            write_nutrient_store)
+from vector_index import (DEFAULT_BATCH_SIZE, DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_MINUTE,
+                          document_ids, has_checkpoint, update_documents, upsert_documents)
+from vector_store import BUCKET_NAME, NUTRIENT_STORE_DIR
 import streamlit as st
 import boto3
 import streamlit as st
-from PIL import Image
+from PIL import Image, ImageOps
 import io
 from datetime import datetime
 import uuid
@@ -23,6 +33,11 @@ import uuid
 load_dotenv()
 openai_api_key = st.secrets["general"]["OPENAI_API_KEY"]
 
+# Vision model input: longest edge in pixels, re-encoding quality and format (JPEG or WEBP)
+IMAGE_MAX_EDGE = 1024
+IMAGE_QUALITY = 85
+IMAGE_FORMAT = "JPEG"
+
 def encode_image(file) -> str:
     """
     Takes a file-like object and returns the base64 encoded image.
@@ -33,6 +48,32 @@ def encode_image(file) -> str:
     except Exception as e:
         raise ValueError(f"Error encoding image: {str(e)}")
 
+def prepare_image(file, max_edge: int = IMAGE_MAX_EDGE, quality: int = IMAGE_QUALITY,
+                  image_format: str = IMAGE_FORMAT) -> tuple:
+    """
+    Prepare an uploaded image for the vision models: apply the EXIF orientation,
+    downsize so the longest edge is at most max_edge, and re-encode as JPEG or WebP.
+    Returns the base64 encoded image and its MIME type.
+    """
+    try:
+        file.seek(0)
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        image_format = image_format.upper()
+        if image_format == "JPEG" and image.mode != "RGB":
+            # JPEG has no alpha channel, flatten transparent images onto white
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=quality, optimize=True)
+        return base64.b64encode(buffer.getvalue()).decode('utf-8'), f"image/{image_format.lower()}"
+    except Exception as e:
+        raise ValueError(f"Error preparing image: {str(e)}")
+
 def encode_image_path(image_path: str) -> str:
     """
     Take the path of image file and return the base64 encoded image.
@@ -46,10 +87,11 @@ def encode_image_path(image_path: str) -> str:
         raise ValueError(f"Error encoding image: {str(e)}")
     
 
-def upload_image(file):
+IMAGE_BUCKET = "food-ai-images"
 
-    bucket_name = "food-ai-images"
 
+def upload_image_bytes(image_bytes: bytes, key: str, content_type: str = 'application/octet-stream') -> str:
+    """Store image bytes in the image bucket under key and return the key."""
     s3 = boto3.client(
         's3',
         aws_access_key_id=st.secrets["aws"]["AWS_ACCESS_KEY_ID"],
@@ -57,29 +99,49 @@ def upload_image(file):
         region_name=st.secrets["aws"]["AWS_DEFAULT_REGION"]
     )
 
+    s3.put_object(
+        Bucket=IMAGE_BUCKET,
+        Key=key,
+        Body=image_bytes,
+        ContentType=content_type
+    )
+    return key
+
+
+def upload_image(file):
+    """Upload an uploaded image to S3 and return its object key (stored with saved meals)."""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     unique_id = str(uuid.uuid4())[:8]
     original_filename = file.name
     extension = original_filename.split('.')[-1]
     filename = f"image_{timestamp}_{unique_id}.{extension}"
 
-    s3.put_object(
-        Bucket=bucket_name,
-        Key=filename,
-        Body=file.getvalue(),
-        ContentType=file.type if file.type else 'application/octet-stream'
-    )
-    
-def filter_food_description_from_USDA_DB(database_url: str):
+    return upload_image_bytes(file.getvalue(), filename, file.type if file.type else 'application/octet-stream')
+
+def filter_food_description_from_USDA_DB(database_url: str, streaming: bool = False, food_key: str = "SRLegacyFoods"):
     """
     Take the USDA database URL and filter the food description from the database.
+    With streaming=True the export is parsed incrementally and descriptions are
+    written row by row, so large exports never need to fit in memory.
     """
+    output_path = "../data/food_db/food_descriptions.csv"
+    if streaming:
+        if Path(output_path).is_file():
+            print('File already exists')
+            return
+        with open(output_path, 'w', newline='') as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+            writer.writerow(['Description'])
+            for item in iter_usda_foods(database_url, food_key):
+                writer.writerow([item['description']])
+        print(f"Processed food descriptions saved to {output_path}")
+        return
+
     with open(database_url, 'r') as file:
         data = json.load(file)
     
-    food_descriptions = [item['description'] for item in data['SRLegacyFoods']]
+    food_descriptions = [item['description'] for item in data[food_key]]
     food_descriptions_df = pd.DataFrame(food_descriptions, columns=['Description'])
-    output_path = "../data/food_db/food_descriptions.csv"
     if not Path(output_path).is_file():
         food_descriptions_df.to_csv(output_path, index=False, quoting=1)
         print(f"Processed food descriptions saved to {output_path}")
@@ -90,23 +152,36 @@ def vector_db(filtered_db_path: str, vector_db_path: str):
     """
     Take the filtered database and vectorize the food descriptions.
     Each line in the file will be one vector.
+    Builds in resumable, idempotent batches (see vector_index.upsert_documents).
     """
+    # Documents are embedded verbatim; the embedding cache is for query-time ingredients only
     openai_embeddings = OpenAIEmbeddings(model="text-embedding-ada-002", api_key=openai_api_key)
-    if not Path(vector_db_path).is_dir():
+    needs_build = not Path(vector_db_path).is_dir() or has_checkpoint(vector_db_path)
+    db = Chroma(persist_directory=vector_db_path, embedding_function=openai_embeddings)
+    if needs_build:
         data = pd.read_csv(filtered_db_path)
         text_data = data['Description'].tolist()
-        db = Chroma.from_texts(text_data, openai_embeddings, persist_directory=vector_db_path)
-    else:
-        db = Chroma(persist_directory=vector_db_path, embedding_function=openai_embeddings)
+        upsert_documents(db, text_data, [None] * len(text_data), document_ids(text_data), vector_db_path)
     return db
 
-def vector_db_json(filtered_db_path: str, vector_db_path: str):
+def vector_db_json(filtered_db_path: str, vector_db_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                   max_workers: int = DEFAULT_MAX_WORKERS, requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE):
     """
     Vectorize a JSON file with descriptions and metadata, storing them in a Chroma vector database.
 
+    Documents are embedded in fixed-size batches with concurrent, rate-limited requests
+    and upserted under ids derived from their description, so a rerun never duplicates
+    the collection and an interrupted build resumes from its checkpoint. Documents whose
+    stored content hash already matches are not embedded again (see
+    vector_index.update_documents), so rerunning a finished build costs no embeddings;
+    documents no longer in the file are removed.
+
     Args:
         filtered_db_path (str): Path to the input JSON file.
         vector_db_path (str): Directory path where the vector database will be stored.
+        batch_size (int): Number of documents per embedding request.
+        max_workers (int): Number of concurrent embedding requests.
+        requests_per_minute (int): Upper bound on embedding requests per minute.
     """
     # Load JSON data
     with open(filtered_db_path, 'r') as file:
@@ -120,28 +195,43 @@ def vector_db_json(filtered_db_path: str, vector_db_path: str):
         persist_directory=vector_db_path
     )
 
-    # Prepare documents and add them to the vector store
-    documents = []
-    ids = []
-    for item in json_data:
-        # Extract description and metadata
-        description = item.get("description", "")
-        metadata = {k: v for k, v in item.items() if k != "description"}
-        
-        # Create a Document
-        doc = Document(
-            page_content=description,
-            metadata=metadata,
-            id=str(uuid4())  # Generate a unique ID for the document
-        )
-        documents.append(doc)
-        ids.append(doc.id)
-
-    # Add documents to the vector store
-    vector_store.add_documents(documents=documents, ids=ids)
-
-
-    print(f"Vector database created and saved at: {vector_db_path}")
+    # Extract descriptions and metadata
+    texts = [item.get("description", "") for item in json_data]
+    metadatas = [{k: v for k, v in item.items() if k != "description"} for item in json_data]
+
+    stats = update_documents(vector_store, texts, metadatas, vector_db_path, batch_size=batch_size,
+                             max_workers=max_workers, requests_per_minute=requests_per_minute)
+
+    print(f"Vector database saved at {vector_db_path}: {stats}")
+
+def update_vector_db_json(filtered_db_path: str, vector_db_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                          max_workers: int = DEFAULT_MAX_WORKERS,
+                          requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE) -> dict:
+    """
+    Incrementally bring an existing vector database in line with a new filtered JSON.
+
+    Only new or changed foods are embedded (see vector_index.update_documents), and
+    foods missing from the new file are deleted. Returns counts of added, changed,
+    removed and unchanged foods.
+    """
+    with open(filtered_db_path, 'r') as file:
+        json_data = json.load(file)
+
+    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+    vector_store = Chroma(
+        collection_name="food_items_collection",
+        embedding_function=embeddings,
+        persist_directory=vector_db_path
+    )
+
+    texts = [item.get("description", "") for item in json_data]
+    metadatas = [{k: v for k, v in item.items() if k != "description"} for item in json_data]
+    stats = update_documents(vector_store, texts, metadatas, vector_db_path, batch_size=batch_size,
+                             max_workers=max_workers, requests_per_minute=requests_per_minute)
+
+    print(f"Vector database at {vector_db_path} updated: {stats}")
+    return stats
+
 def filter_nutrition_data(food_data):
     """
     Filters the food data to only include the desired nutrient information.
@@ -162,10 +252,12 @@ def filter_nutrition_data(food_data):
     
     return result
 
-def process_food_db(input_file, output_file):
+def process_food_db(input_file, output_file, nutrient_store_dir=None):
     """
     Processes the entire food database, filters relevant nutrient information,
     and saves it to a new file.
+    Also writes the numeric columnar nutrient store (see nutrient_store.py), by default
+    into a "nutrient_store" directory next to the output file.
     """
     # Load the input JSON file
     with open(input_file, 'r') as file:
@@ -181,6 +273,108 @@ def process_food_db(input_file, output_file):
     with open(output_file, 'w') as file:
         json.dump(processed_data, file, indent=4)
 
+    if nutrient_store_dir is None:
+        nutrient_store_dir = os.path.join(os.path.dirname(output_file), NUTRIENT_STORE_DIR)
+    count = write_nutrient_store(food_db["SRLegacyFoods"], nutrient_store_dir)
+    print(f"Nutrient store with {count} foods saved to {nutrient_store_dir}")
+
+def publish_nutrient_store(store_dir: str, bucket_name: str = BUCKET_NAME):
+    """
+    Upload a nutrient store to the food DB bucket under the nutrient_store/ prefix,
+    which is where the app's S3 sync places it next to vector_db_json.
+    The manifest is uploaded last so a sync racing the upload never pairs it with
+    the previous data files.
+    """
+    s3 = boto3.client('s3')
+    for name in (VALUES_FILE, DESCRIPTIONS_FILE, MANIFEST_FILE):
+        s3.upload_file(os.path.join(store_dir, name), bucket_name, f"{NUTRIENT_STORE_DIR}/{name}")
+    print(f"Nutrient store in {store_dir} published to s3://{bucket_name}/{NUTRIENT_STORE_DIR}/")
+
+def iter_usda_foods(input_file, food_key="SRLegacyFoods"):
+    """
+    Incrementally yield the food items of a USDA export ("SRLegacyFoods", "BrandedFoods",
+    "SurveyFoods", ...) without loading the whole JSON document into memory.
+    """
+    with open(input_file, 'rb') as file:
+        yield from ijson.items(file, f"{food_key}.item", use_float=True)
+
+
+def _chunked(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _process_food_chunk(chunk):
+    """Worker for process_food_db_streaming: filter one chunk of food items."""
+    filtered = [filter_nutrition_data(food_item) for food_item in chunk]
+    descriptions = [food_item["description"] for food_item in chunk]
+    rows = [nutrient_row(food_item) for food_item in chunk]
+    return filtered, descriptions, rows
+
+
+def _bounded_map(pool, fn, iterable, max_in_flight):
+    """
+    Like pool.map, but never reads more than max_in_flight chunks ahead of the
+    consumer, so memory stays bounded however large the input is. Results keep input order.
+    """
+    in_flight = deque()
+    for item in iterable:
+        in_flight.append(pool.submit(fn, item))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def process_food_db_streaming(input_file, output_file, food_key="SRLegacyFoods", nutrient_store_dir=None,
+                              chunk_size=1000, max_workers=None):
+    """
+    Streaming variant of process_food_db for exports too large to json.load
+    (Branded Foods, FNDDS, ...).
+
+    Items are parsed incrementally, filtered in chunks by a process pool and written
+    to the output JSON and the nutrient store as soon as each chunk is done, so peak
+    memory is bounded by chunk_size and the number of workers, not by the input size.
+    Reports items/sec and peak RSS at the end.
+    """
+    if nutrient_store_dir is None:
+        nutrient_store_dir = os.path.join(os.path.dirname(output_file), NUTRIENT_STORE_DIR)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    count = 0
+    with open(output_file, 'w') as file, \
+            NutrientStoreWriter(nutrient_store_dir) as store_writer, \
+            ProcessPoolExecutor(max_workers=max_workers) as pool:
+        file.write("[")
+        chunks = _chunked(iter_usda_foods(input_file, food_key), chunk_size)
+        for filtered, descriptions, rows in _bounded_map(pool, _process_food_chunk, chunks, max_workers * 2):
+            for filtered_data in filtered:
+                # Same layout as json.dump(processed_data, file, indent=4)
+                file.write(",\n" if count else "\n")
+                file.write(textwrap.indent(json.dumps(filtered_data, indent=4), "    "))
+                count += 1
+            store_writer.append(descriptions, rows)
+        file.write("\n]" if count else "]")
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {count} {food_key} items in {elapsed:.1f}s "
+          f"({count / elapsed if elapsed else 0:.0f} items/sec), peak RSS {_peak_rss_mb():.0f} MB")
+    return count
+
 # # File paths
 # input_file = "../../backend/data/food_db/fooddb.json"  # Replace with your input file path
 # output_file = "./filtered_fooddb.json"  # Replace with your desired output file path
@@ -193,3 +387,24 @@ def process_food_db(input_file, output_file):
 # vector_db_path = "../data/food_db/vector_db_json"
 # db = vector_db_json(filtered_db_path, vector_db_path)
 
+
+# Delta re-index after a USDA data refresh:
+# python preprocess.py update-index --filtered-db ../data/food_db/filtered_fooddb.json --vector-db ../data/food_db/vector_db_json
+# python preprocess.py publish-nutrient-store --store-dir ../data/food_db/nutrient_store
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Food DB preprocessing commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser("update-index", help="Embed only new/changed foods and delete removed ones")
+    update_parser.add_argument("--filtered-db", default="../data/food_db/filtered_fooddb.json")
+    update_parser.add_argument("--vector-db", default="../data/food_db/vector_db_json")
+    publish_parser = subparsers.add_parser("publish-nutrient-store", help="Upload the nutrient store to the food DB bucket")
+    publish_parser.add_argument("--store-dir", default="../data/food_db/nutrient_store")
+    publish_parser.add_argument("--bucket", default=BUCKET_NAME)
+    args = parser.parse_args()
+
+    if args.command == "update-index":
+        update_vector_db_json(args.filtered_db, args.vector_db)
+    elif args.command == "publish-nutrient-store":
+        publish_nutrient_store(args.store_dir, args.bucket)
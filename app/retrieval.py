@@ -0,0 +1,82 @@
+from lexical_index import DEFAULT_MIN_SCORE
+
+
+def _vector_matches(db, ingredients: list, k: int) -> dict:
+    """
+    Embed all ingredients with one embed_documents call and match them with one
+    multi-query against the Chroma collection. Returns {ingredient: [matches]}.
+    """
+    if not ingredients:
+        return {}
+    query_embeddings = db.embeddings.embed_documents(ingredients)
+
+    results = db._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        include=["documents", "metadatas", "distances"]
+    )
+    relevance_score = db._select_relevance_score_fn()
+
+    matches_by_ingredient = {}
+    for i, ingredient in enumerate(ingredients):
+        matches_by_ingredient[ingredient] = [
+            {
+                "description": document,
+                "metadata": metadata or {},
+                "score": relevance_score(distance),
+                "source": "vector"
+            }
+            for document, metadata, distance in zip(
+                results["documents"][i],
+                results["metadatas"][i],
+                results["distances"][i]
+            )
+        ]
+    return matches_by_ingredient
+
+
+def lookup_ingredients(db, ingredients: list, k: int = 1, lexical_index=None,
+                       min_lexical_score: float = DEFAULT_MIN_SCORE) -> list:
+    """
+    Find the closest USDA food descriptions for a batch of ingredients.
+
+    If a lexical index is given, each ingredient is first matched lexically and only
+    the ingredients scoring below min_lexical_score go to the vector search. The
+    remaining ingredients are embedded with a single embed_documents call and matched
+    with one multi-query against the Chroma collection, so retrieval latency stays
+    roughly constant in the number of ingredients.
+
+    Returns one entry per ingredient (in input order) with the best matching
+    description, its metadata, a relevance score (higher is closer), the source
+    ("lexical" or "vector") and the full list of matches. Ingredients without any
+    match get a None description.
+    """
+    if not ingredients:
+        return []
+
+    # Look up each distinct ingredient only once
+    unique_ingredients = list(dict.fromkeys(ingredients))
+
+    matches_by_ingredient = {}
+    if lexical_index is not None:
+        for ingredient in unique_ingredients:
+            match = lexical_index.lookup(ingredient, min_score=min_lexical_score)
+            if match is not None:
+                matches_by_ingredient[ingredient] = [dict(match, source="lexical")]
+
+    remaining = [ingredient for ingredient in unique_ingredients if ingredient not in matches_by_ingredient]
+    matches_by_ingredient.update(_vector_matches(db, remaining, k))
+
+    lookups = []
+    for ingredient in ingredients:
+        matches = matches_by_ingredient[ingredient]
+        best = matches[0] if matches else {"description": None, "metadata": {}, "score": None, "source": None}
+        lookups.append({
+            "ingredient": ingredient,
+            "description": best["description"],
+            "metadata": best["metadata"],
+            "score": best["score"],
+            "source": best["source"],
+            "matches": matches
+        })
+    return lookups
@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_NAME = ".s3_manifest.json"
+# Version directories younger than this may be another process's sync in progress
+STALE_VERSION_SECONDS = 3600
+
+
+def _load_manifest(local_dir: str) -> dict:
+    manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        # A corrupt manifest only costs a full re-download
+        return {}
+
+
+def _write_manifest(local_dir: str, manifest: dict):
+    manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+    with tempfile.NamedTemporaryFile('w', dir=local_dir, delete=False, suffix='.tmp') as file:
+        json.dump(manifest, file, indent=2)
+        temp_path = file.name
+    os.replace(temp_path, manifest_path)
+
+
+def list_bucket(s3, bucket_name: str) -> dict:
+    """
+    Return {key: {"etag": ..., "size": ...}} for every object in the bucket.
+    """
+    objects = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key.endswith('/'):
+                # Folder placeholder objects have nothing to download
+                continue
+            objects[key] = {"etag": obj['ETag'], "size": obj['Size']}
+    return objects
+
+
+def _link_or_copy(source: str, target: str):
+    # Unchanged files are hard links into the previous version, so a sync costs no copies
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _remove_old_versions(parent_dir: str, prefix: str, keep: set):
+    cutoff = time.time() - STALE_VERSION_SECONDS
+    for name in os.listdir(parent_dir):
+        path = os.path.join(parent_dir, name)
+        if (name.startswith(prefix) and path not in keep and not os.path.islink(path)
+                and os.path.getmtime(path) < cutoff):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def sync_s3_bucket(s3, bucket_name: str, local_dir: str, max_workers: int = 8) -> dict:
+    """
+    Incrementally mirror an S3 bucket into local_dir.
+
+    A local manifest of key/ETag/size is compared against the bucket listing so
+    unchanged objects are skipped. Every sync that changes anything builds a complete
+    new version of the tree in a sibling directory: unchanged files are hard-linked
+    from the current version and changed objects are downloaded concurrently with the
+    shared client. local_dir is a symlink to the current version, and it is flipped to
+    the new one with a single rename once every download succeeded. Readers therefore
+    see either the old tree or the new one, never a mix, and a failed sync leaves the
+    old tree untouched. Objects removed from the bucket are simply not part of the new
+    version. The previous version is kept for processes that still have it open;
+    older ones are deleted once they are STALE_VERSION_SECONDS old.
+
+    A local_dir that is still a plain directory (from before versioning) is moved
+    aside and replaced by the symlink on its first changing sync.
+
+    Returns counts of downloaded, skipped and removed objects.
+    """
+    link_path = os.path.abspath(local_dir.rstrip('/'))
+    parent_dir = os.path.dirname(link_path)
+    version_prefix = f".{os.path.basename(link_path)}."
+    os.makedirs(parent_dir, exist_ok=True)
+    manifest = _load_manifest(link_path) if os.path.isdir(link_path) else {}
+    remote = list_bucket(s3, bucket_name)
+
+    changed = []
+    for key, info in remote.items():
+        local_file_path = os.path.join(link_path, key)
+        if (manifest.get(key) != info
+                or not os.path.isfile(local_file_path)
+                or os.path.getsize(local_file_path) != info["size"]):
+            changed.append(key)
+    removed = [key for key in manifest if key not in remote]
+
+    stats = {"downloaded": len(changed), "skipped": len(remote) - len(changed), "removed": len(removed)}
+    if not changed and not removed and os.path.isdir(link_path):
+        return stats
+
+    # The new version lives next to local_dir so the final rename stays on one filesystem
+    version_dir = tempfile.mkdtemp(prefix=version_prefix, dir=parent_dir)
+    try:
+        for key in remote:
+            os.makedirs(os.path.dirname(os.path.join(version_dir, key)), exist_ok=True)
+        changed_keys = set(changed)
+        for key in remote:
+            if key not in changed_keys:
+                _link_or_copy(os.path.join(link_path, key), os.path.join(version_dir, key))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(s3.download_file, bucket_name, key, os.path.join(version_dir, key))
+                for key in changed
+            ]
+            for future in futures:
+                future.result()
+        _write_manifest(version_dir, remote)
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+
+    previous_dir = os.path.realpath(link_path) if os.path.exists(link_path) else None
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        # Pre-versioning layout: keep the old copy around as the previous version
+        previous_dir = tempfile.mkdtemp(prefix=version_prefix, dir=parent_dir)
+        os.rmdir(previous_dir)
+        os.rename(link_path, previous_dir)
+
+    # Every download succeeded, point local_dir at the new version in one rename
+    temp_link = f"{version_dir}.link"
+    os.symlink(os.path.basename(version_dir), temp_link)
+    os.replace(temp_link, link_path)
+    _remove_old_versions(parent_dir, version_prefix, {version_dir, previous_dir})
+
+    print(f"Synced s3://{bucket_name} to {local_dir}: {stats}")
+    return stats
@@ -56,7 +56,7 @@ def verify_session():
             # Create/update MongoDB session
             with MongoDB() as mongo:
                 user_data = mongo.create_or_get_user(st.session_state['user_info'])
-                st.query_params['session_token'] = user_data['session_token']
+                st.query_params['session_token'] = user_data.session_token
         return True
         
     # If not authenticated via Google, check for session token
@@ -67,9 +67,9 @@ def verify_session():
             if user:
                 st.session_state['connected'] = True
                 st.session_state['user_info'] = {
-                    'email': user['email'],
-                    'name': user['name'],
-                    'picture': user.get('picture', '')
+                    'email': user.email,
+                    'name': user.name,
+                    'picture': user.picture
                 }
                 st.session_state['user'] = st.session_state['user_info']
                 return True
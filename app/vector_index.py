@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+CHECKPOINT_NAME = ".index_checkpoint.jsonl"
+MANIFEST_NAME = ".index_manifest.json"
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_REQUESTS_PER_MINUTE = 300
+# Stored documents copied or deleted per Chroma call when no embedding is involved
+DEFAULT_REKEY_BATCH_SIZE = 1000
+
+
+def document_ids(descriptions: list) -> list:
+    """
+    Derive deterministic document ids from food descriptions.
+    Repeated descriptions get an occurrence suffix so every item keeps its own id.
+    """
+    seen = {}
+    ids = []
+    for description in descriptions:
+        digest = hashlib.sha256(description.encode('utf-8')).hexdigest()[:32]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        ids.append(digest if occurrence == 0 else f"{digest}-{occurrence}")
+    return ids
+
+
+def content_hash(description: str, metadata: dict) -> str:
+    """Hash of everything stored for one document, used to detect changed foods."""
+    payload = json.dumps({"description": description, "metadata": metadata or {}}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def save_index_manifest(vector_db_path: str, manifest: dict):
+    """Atomically write the {document id: content hash} manifest of a vector database."""
+    manifest_path = os.path.join(vector_db_path, MANIFEST_NAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temp_path, manifest_path)
+
+
+def load_index_manifest(vector_store, vector_db_path: str) -> dict:
+    """
+    Load the {document id: content hash} manifest of a vector database. Databases built
+    before manifests existed get one reconstructed from the stored documents; if they
+    were built with random (uuid4) ids, their stored vectors are first re-keyed to the
+    document_ids() ids so that nothing has to be embedded again.
+    """
+    manifest_path = os.path.join(vector_db_path, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+
+    records = vector_store._collection.get(include=["documents", "metadatas", "embeddings"])
+    old_ids = records["ids"]
+    documents = records["documents"]
+    metadatas = [metadata or {} for metadata in records["metadatas"]]
+    new_ids = document_ids(documents)
+
+    rekeyed = [i for i, (old_id, new_id) in enumerate(zip(old_ids, new_ids)) if old_id != new_id]
+    if rekeyed:
+        new_id_set = set(new_ids)
+        for start in range(0, len(rekeyed), DEFAULT_REKEY_BATCH_SIZE):
+            batch = rekeyed[start:start + DEFAULT_REKEY_BATCH_SIZE]
+            _upsert_batch(vector_store, batch, [records["embeddings"][i] for i in batch],
+                          documents, metadatas, new_ids)
+            # An old id can only collide with a derived id in a partially re-keyed store
+            stale = [old_ids[i] for i in batch if old_ids[i] not in new_id_set]
+            if stale:
+                vector_store._collection.delete(ids=stale)
+        print(f"Re-keyed {len(rekeyed)} stored documents to content-derived ids")
+
+    manifest = {
+        doc_id: content_hash(document, metadata)
+        for doc_id, document, metadata in zip(new_ids, documents, metadatas)
+    }
+    save_index_manifest(vector_db_path, manifest)
+    return manifest
+
+
+def update_documents(vector_store, texts: list, metadatas: list, vector_db_path: str,
+                     batch_size: int = DEFAULT_BATCH_SIZE, max_workers: int = DEFAULT_MAX_WORKERS,
+                     requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE) -> dict:
+    """
+    Bring a vector store in line with a new list of documents.
+
+    Each document is compared against the stored manifest of content hashes: only new or
+    changed documents are embedded and upserted, and documents missing from the new list
+    are deleted, so the cost scales with the size of the change rather than the database.
+    Returns counts of added, changed, removed and unchanged documents.
+    """
+    ids = document_ids(texts)
+    new_manifest = {
+        doc_id: content_hash(text, metadata) for doc_id, text, metadata in zip(ids, texts, metadatas)
+    }
+    old_manifest = load_index_manifest(vector_store, vector_db_path)
+
+    changed = [i for i, doc_id in enumerate(ids) if old_manifest.get(doc_id) != new_manifest[doc_id]]
+    removed = [doc_id for doc_id in old_manifest if doc_id not in new_manifest]
+    stats = {
+        "added": sum(1 for i in changed if ids[i] not in old_manifest),
+        "changed": sum(1 for i in changed if ids[i] in old_manifest),
+        "removed": len(removed),
+        "unchanged": len(ids) - len(changed)
+    }
+
+    if changed:
+        upsert_documents(vector_store, [texts[i] for i in changed], [metadatas[i] for i in changed],
+                         [ids[i] for i in changed], vector_db_path, batch_size=batch_size,
+                         max_workers=max_workers, requests_per_minute=requests_per_minute)
+    for start in range(0, len(removed), DEFAULT_REKEY_BATCH_SIZE):
+        vector_store._collection.delete(ids=removed[start:start + DEFAULT_REKEY_BATCH_SIZE])
+    save_index_manifest(vector_db_path, new_manifest)
+    return stats
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing request start times to stay under a per-minute budget."""
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _load_checkpoint(checkpoint_path: str) -> set:
+    if not os.path.isfile(checkpoint_path):
+        return set()
+    done = set()
+    with open(checkpoint_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                # A torn last line from an interrupted write is simply redone
+                try:
+                    done.update(json.loads(line))
+                except ValueError:
+                    pass
+    return done
+
+
+def has_checkpoint(vector_db_path: str) -> bool:
+    """True if an earlier build into vector_db_path was interrupted and can be resumed."""
+    return os.path.isfile(os.path.join(vector_db_path, CHECKPOINT_NAME))
+
+
+def _upsert_batch(vector_store, batch: list, vectors: list, texts: list, metadatas: list, ids: list):
+    # Chroma rejects empty metadata, so documents without any are upserted separately
+    with_metadata = [j for j, i in enumerate(batch) if metadatas[i]]
+    without_metadata = [j for j, i in enumerate(batch) if not metadatas[i]]
+    for group, has_metadata in ((with_metadata, True), (without_metadata, False)):
+        if not group:
+            continue
+        vector_store._collection.upsert(
+            ids=[ids[batch[j]] for j in group],
+            embeddings=[vectors[j] for j in group],
+            documents=[texts[batch[j]] for j in group],
+            metadatas=[metadatas[batch[j]] for j in group] if has_metadata else None
+        )
+
+
+def upsert_documents(vector_store, texts: list, metadatas: list, ids: list, vector_db_path: str,
+                     batch_size: int = DEFAULT_BATCH_SIZE, max_workers: int = DEFAULT_MAX_WORKERS,
+                     requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE) -> int:
+    """
+    Embed and upsert documents into a Chroma store in fixed-size batches.
+
+    Batches are embedded concurrently under a request rate limit and upserted by id,
+    so rerunning a build never duplicates documents. Every upserted batch is appended
+    to a checkpoint file in vector_db_path; an interrupted build skips the ids already
+    recorded there and resumes where it stopped. The checkpoint is removed once all
+    documents are stored. Returns the number of documents embedded in this run.
+    """
+    os.makedirs(vector_db_path, exist_ok=True)
+    checkpoint_path = os.path.join(vector_db_path, CHECKPOINT_NAME)
+    done = _load_checkpoint(checkpoint_path)
+
+    pending = [i for i, doc_id in enumerate(ids) if doc_id not in done]
+    batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+    if done:
+        print(f"Resuming build: {len(done)} documents already stored, {len(pending)} to go")
+
+    embeddings = vector_store.embeddings
+    limiter = RateLimiter(requests_per_minute)
+
+    def embed_batch(batch):
+        limiter.wait()
+        return batch, embeddings.embed_documents([texts[i] for i in batch])
+
+    embedded = 0
+    with open(checkpoint_path, 'a') as checkpoint, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(embed_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            try:
+                batch, vectors = future.result()
+            except BaseException:
+                # Don't keep paying for embeddings that will never be stored
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            batch_ids = [ids[i] for i in batch]
+            # Chroma writes happen on this thread only
+            _upsert_batch(vector_store, batch, vectors, texts, metadatas, ids)
+            checkpoint.write(json.dumps(batch_ids) + "\n")
+            checkpoint.flush()
+            embedded += len(batch)
+            print(f"Indexed {embedded}/{len(pending)} documents")
+
+    os.remove(checkpoint_path)
+    return embedded
@@ -0,0 +1,114 @@
+import os
+import threading
+
+import boto3
+import streamlit as st
+from langchain_chroma import Chroma
+from langchain_openai import OpenAIEmbeddings
+
+from embedding_cache import CachedEmbeddings
+from lexical_index import LexicalIndex
+from nutrient_store import MANIFEST_FILE, NutrientStore
+from s3_sync import sync_s3_bucket
+
+BUCKET_NAME = "food-ai-db"
+LOCAL_DIR = "../data/food_db_cloud/"
+COLLECTION_NAME = "food_items_collection"
+EMBEDDING_MODEL = "text-embedding-3-large"
+# Key prefix of the nutrient store inside the bucket, and its directory under LOCAL_DIR
+NUTRIENT_STORE_DIR = "nutrient_store"
+
+# One store per process, shared by every Streamlit session
+_store = None
+_lexical_index = None
+_nutrient_store = None
+_lock = threading.Lock()
+
+
+def download_s3_bucket(bucket_name, local_dir):
+    # Create an S3 client
+    s3 = boto3.client(
+        's3',
+        aws_access_key_id=st.secrets["aws"]["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=st.secrets["aws"]["AWS_SECRET_ACCESS_KEY"],
+        region_name=st.secrets["aws"]["AWS_DEFAULT_REGION"]
+    )
+
+    # Only objects whose ETag/size changed since the last sync are downloaded
+    return sync_s3_bucket(s3, bucket_name, local_dir)
+
+
+def _load_vector_store():
+    download_s3_bucket(BUCKET_NAME, LOCAL_DIR)
+    db_path = os.path.join(LOCAL_DIR, "vector_db_json")
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=CachedEmbeddings(
+            OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=st.secrets["general"]["OPENAI_API_KEY"]),
+            model=EMBEDDING_MODEL
+        ),
+        persist_directory=db_path
+    )
+
+
+def is_vector_store_ready() -> bool:
+    """True once the shared vector store has been loaded in this process."""
+    return _store is not None
+
+
+def get_vector_store():
+    """
+    Return the process-wide Chroma store, loading it on first use.
+
+    Initialization is single-flight: concurrent callers block on the same lock, so
+    only the first one syncs S3 and opens Chroma while the others wait for its result.
+    If loading fails the error is raised to the caller and the next call retries.
+    """
+    global _store
+    if _store is not None:
+        return _store
+    with _lock:
+        if _store is None:
+            _store = _load_vector_store()
+    return _store
+
+
+def get_lexical_index():
+    """
+    Return the process-wide lexical index over the vector store's descriptions,
+    building it once from the Chroma collection (no embedding calls needed).
+    """
+    global _lexical_index
+    if _lexical_index is not None:
+        return _lexical_index
+    db = get_vector_store()
+    with _lock:
+        if _lexical_index is None:
+            _lexical_index = LexicalIndex.from_chroma(db)
+    return _lexical_index
+
+
+def get_nutrient_store():
+    """
+    Return the process-wide, memory-mapped nutrient store synced alongside the vector
+    database, or None if the bucket does not contain one. The store is published to
+    s3://food-ai-db/nutrient_store/ by `python preprocess.py publish-nutrient-store`.
+    """
+    global _nutrient_store
+    if _nutrient_store is not None:
+        return _nutrient_store
+    get_vector_store()
+    store_dir = os.path.join(LOCAL_DIR, NUTRIENT_STORE_DIR)
+    if not os.path.isfile(os.path.join(store_dir, MANIFEST_FILE)):
+        return None
+    with _lock:
+        if _nutrient_store is None:
+            _nutrient_store = NutrientStore.load(store_dir)
+    return _nutrient_store
+
+
+def warm_up_vector_store():
+    """Load the shared vector store and the indexes built from it, ahead of the first lookup."""
+    get_vector_store()
+    get_lexical_index()
+    get_nutrient_store()
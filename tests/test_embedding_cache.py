@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+pytest.importorskip("langchain_core")
+from embedding_cache import canonicalize, singularize  # noqa: E402
+
+
+@pytest.mark.parametrize("plural, singular", [
+    ("avocados", "avocado"),
+    ("eggs", "egg"),
+    ("pies", "pie"),
+    ("tomatoes", "tomato"),
+    ("peaches", "peach"),
+    ("dishes", "dish"),
+    ("cheeses", "cheese"),
+])
+def test_plurals_fold_to_singular(plural, singular):
+    assert singularize(plural) == singular
+    assert singularize(singular) == singular
+
+
+@pytest.mark.parametrize("word", ["molasses", "hummus", "couscous", "asparagus", "bass", "swiss", "pea", "gas"])
+def test_non_plurals_are_kept(word):
+    assert singularize(word) == word
+
+
+def test_canonicalize_folds_case_whitespace_and_plurals():
+    assert canonicalize("  Avocados ") == canonicalize("avocado")
+    assert canonicalize("Hard-boiled   EGGS") == "hard-boiled egg"
+    assert canonicalize("Molasses") == "molasses"
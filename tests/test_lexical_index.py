@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+pytest.importorskip("langchain_core")
+from lexical_index import LexicalIndex  # noqa: E402
+
+DESCRIPTIONS = [
+    "Butter, salted",
+    "Butter, without salt",
+    "Cereals ready-to-eat, sweetened",
+    "Beverages, almond milk, sweetened, vanilla flavor",
+    "Beverages, almond milk, unsweetened, shelf stable",
+    "Milk, nonfat, fluid, with added vitamin A and vitamin D",
+    "Milk, whole, 3.25% milkfat",
+    "Yogurt, plain, whole milk",
+    "Yogurt, plain, skim milk",
+    "Eggs, whole, raw",
+    "Avocados, raw",
+]
+
+
+@pytest.fixture
+def index():
+    return LexicalIndex(DESCRIPTIONS, [{} for _ in DESCRIPTIONS])
+
+
+@pytest.mark.parametrize("ingredient, wrong_match", [
+    ("unsalted butter", "Butter, salted"),
+    ("salted butter without", "Butter, without salt"),
+    ("unsweetened almond milk", "Beverages, almond milk, sweetened, vanilla flavor"),
+    ("sweetened almond milk", "Beverages, almond milk, unsweetened, shelf stable"),
+    ("nonfat milk", "Milk, whole, 3.25% milkfat"),
+    ("fat milk", "Milk, nonfat, fluid, with added vitamin A and vitamin D"),
+    ("nonfat yogurt", "Yogurt, plain, whole milk"),
+])
+def test_qualified_ingredients_never_match_the_opposite_food(index, ingredient, wrong_match):
+    match = index.lookup(ingredient)
+    assert match is None or match["description"] != wrong_match
+
+
+def test_opposite_qualifiers_fall_back_to_the_vector_search(index):
+    assert index.lookup("unsalted butter") is None
+    assert index.lookup("unsweetened cereal") is None
+    assert index.lookup("nonfat milk") is None
+
+
+def test_reordered_and_plural_descriptions_match_exactly(index):
+    assert index.lookup("salted butter") == {"description": "Butter, salted", "metadata": {}, "score": 1.0}
+    assert index.lookup("raw avocado")["description"] == "Avocados, raw"
+    assert index.lookup("whole raw egg")["description"] == "Eggs, whole, raw"
+
+
+def test_extra_description_words_lower_the_score(index):
+    assert index.lookup("almond milk") is None
+    match = index.lookup("almond milk", min_score=0.3)
+    assert match["score"] == pytest.approx(2 / 6)
@@ -0,0 +1,46 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from nutrient_store import MANIFEST_FILE, NutrientStore, NutrientStoreWriter, write_nutrient_store  # noqa: E402
+
+
+def _food(description, carbs, energy):
+    return {"description": description, "foodNutrients": [
+        {"nutrient": {"id": 1005}, "amount": carbs},
+        {"nutrient": {"id": 1008}, "amount": energy},
+    ]}
+
+
+def test_empty_store_loads(tmp_path):
+    assert write_nutrient_store([], str(tmp_path)) == 0
+    store = NutrientStore.load(str(tmp_path))
+    assert store.values.shape == (0, 4)
+    assert store.index_of("Butter, salted") is None
+
+
+def test_to_frame_rounds_float32_values(tmp_path):
+    write_nutrient_store([_food("Rice, white, cooked", 12.3, 130)], str(tmp_path))
+    store = NutrientStore.load(str(tmp_path))
+    df = store.to_frame(["rice"], [store.index_of("Rice, white, cooked")])
+    row = json.loads(df.to_json(orient="records"))[0]
+    assert row["Carbohydrate (g)"] == 12.3
+    assert row["Energy (kcal)"] == 130
+    assert row["Protein (g)"] is None
+
+
+def test_failed_write_keeps_the_previous_store(tmp_path):
+    write_nutrient_store([_food("Apples, raw", 13.8, 52)], str(tmp_path))
+    with pytest.raises(RuntimeError):
+        with NutrientStoreWriter(str(tmp_path)) as writer:
+            writer.append(["Bananas, raw"], [[22.8, 89, 1.1, 0.3]])
+            raise RuntimeError("interrupted")
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        ["descriptions.jsonl", MANIFEST_FILE, "nutrients.f32"]
+    )
+    assert NutrientStore.load(str(tmp_path)).descriptions == ["Apples, raw"]
@@ -0,0 +1,85 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from nutrition_parser import parse_summary_table  # noqa: E402
+
+EXPECTED = [
+    {"nutrient": "energy", "min": 493.0, "max": 611.0},
+    {"nutrient": "protein", "min": 32.0, "max": 39.0},
+    {"nutrient": "fat", "min": 20.0, "max": 25.0},
+    {"nutrient": "carbs", "min": 40.0, "max": 50.0},
+]
+
+PIPE_TABLE = """### Overview
+Grilled chicken with rice. The fat is mostly from the skin.
+
+### Summary
+
+| Nutrient | Estimated Total |
+|----------|-----------------|
+| Energy (kcal) | 493 - 611 kcal |
+| Protein (g) | 32-39g |
+| Fat (g) | 20 – 25 g |
+| Carbohydrates (g) | 40 to 50 g |
+"""
+
+
+def test_pipe_table():
+    assert parse_summary_table(PIPE_TABLE) == EXPECTED
+
+
+def test_bold_heading_and_cells():
+    response = """**Summary:**
+| **Nutrient** | **Range** |
+|---|---|
+| **Energy** | **493 - 611 kcal** |
+| **Protein** | **32 - 39 g** |
+| **Fat** | **20 - 25 g** |
+| **Carbs** | **40 - 50 g** |
+"""
+    assert parse_summary_table(response) == EXPECTED
+
+
+def test_trailing_summary_sentence_is_not_the_heading():
+    assert parse_summary_table(PIPE_TABLE + "\nThis summary is an estimate.\n") == EXPECTED
+    assert parse_summary_table(PIPE_TABLE + "\nIn summary, a balanced dish.\n") == EXPECTED
+
+
+def test_saturated_fat_row_is_not_the_fat_total():
+    response = """### Summary
+| Nutrient | Range |
+|---|---|
+| Calories from fat | 180 - 225 kcal |
+| Energy | 493 - 611 kcal |
+| Protein | 32 - 39 g |
+| Saturated Fat | 3 - 4 g |
+| Total Fat | 20 - 25 g |
+| Dietary Fiber | 5 - 6 g |
+| Sugars | 2 - 3 g |
+| Total Carbohydrates | 40 - 50 g |
+"""
+    assert parse_summary_table(response) == EXPECTED
+
+
+def test_label_value_lines():
+    response = "Summary\nEnergy: 493 - 611 kcal\nProtein: 32 - 39 g\nFat: 20 - 25 g\nCarbs: 40 - 50 g\n"
+    assert parse_summary_table(response) == EXPECTED
+
+
+def test_only_the_first_table_after_the_heading_is_read():
+    response = """### Summary
+| Energy | 493 - 611 kcal |
+| Protein | 32 - 39 g |
+
+| Fat | 20 - 25 g |
+| Carbs | 40 - 50 g |
+"""
+    assert parse_summary_table(response) is None
+
+
+def test_missing_heading_or_nutrient():
+    assert parse_summary_table("Energy: 493 - 611 kcal") is None
+    assert parse_summary_table("### Summary\n| Energy | 493 - 611 kcal |\n") is None
+    assert parse_summary_table(None) is None
@@ -0,0 +1,92 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from s3_sync import sync_s3_bucket  # noqa: E402
+
+
+class _Paginator:
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def paginate(self, Bucket):
+        yield {"Contents": [
+            {"Key": key, "ETag": f'"{hash(body)}"', "Size": len(body)} for key, body in self.bucket.objects.items()
+        ]}
+
+
+class FakeS3:
+    """In-memory bucket exposing the client calls sync_s3_bucket makes."""
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self.downloaded = []
+        self.fail_on = None
+
+    def get_paginator(self, name):
+        return _Paginator(self)
+
+    def download_file(self, bucket_name, key, path):
+        if key == self.fail_on:
+            raise OSError(f"download of {key} failed")
+        self.downloaded.append(key)
+        with open(path, "wb") as file:
+            file.write(self.objects[key])
+
+
+def _read(local_dir, key):
+    with open(os.path.join(local_dir, key), "rb") as file:
+        return file.read()
+
+
+def test_sync_swaps_in_a_complete_new_version(tmp_path):
+    local_dir = str(tmp_path / "food_db_cloud")
+    s3 = FakeS3({"vector_db_json/chroma.sqlite3": b"v1", "nutrient_store/manifest.json": b"m1"})
+    sync_s3_bucket(s3, "bucket", local_dir)
+    first_version = os.path.realpath(local_dir)
+
+    s3.objects["vector_db_json/chroma.sqlite3"] = b"v2-longer"
+    del s3.objects["nutrient_store/manifest.json"]
+    s3.downloaded = []
+    stats = sync_s3_bucket(s3, "bucket", local_dir)
+
+    assert stats == {"downloaded": 1, "skipped": 0, "removed": 1}
+    assert s3.downloaded == ["vector_db_json/chroma.sqlite3"]
+    assert os.path.islink(local_dir)
+    assert _read(local_dir, "vector_db_json/chroma.sqlite3") == b"v2-longer"
+    assert not os.path.exists(os.path.join(local_dir, "nutrient_store/manifest.json"))
+    # The previous version is left intact for readers that still have it open
+    assert _read(first_version, "vector_db_json/chroma.sqlite3") == b"v1"
+
+
+def test_failed_sync_leaves_the_current_version_untouched(tmp_path):
+    local_dir = str(tmp_path / "food_db_cloud")
+    s3 = FakeS3({"a.bin": b"a1", "b.bin": b"b1"})
+    sync_s3_bucket(s3, "bucket", local_dir)
+    current = os.path.realpath(local_dir)
+
+    s3.objects.update({"a.bin": b"a2-new", "b.bin": b"b2-new"})
+    s3.fail_on = "b.bin"
+    with pytest.raises(OSError):
+        sync_s3_bucket(s3, "bucket", local_dir)
+
+    assert os.path.realpath(local_dir) == current
+    assert _read(local_dir, "a.bin") == b"a1"
+    assert _read(local_dir, "b.bin") == b"b1"
+
+
+def test_plain_directory_is_replaced_by_a_versioned_link(tmp_path):
+    local_dir = tmp_path / "food_db_cloud"
+    local_dir.mkdir()
+    (local_dir / "a.bin").write_bytes(b"old")
+    s3 = FakeS3({"a.bin": b"new"})
+
+    sync_s3_bucket(s3, "bucket", str(local_dir) + "/")
+
+    assert os.path.islink(local_dir)
+    assert _read(str(local_dir), "a.bin") == b"new"
+    assert sync_s3_bucket(s3, "bucket", str(local_dir)) == {"downloaded": 0, "skipped": 1, "removed": 0}
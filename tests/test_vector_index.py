@@ -0,0 +1,112 @@
+import sys
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from vector_index import MANIFEST_NAME, document_ids, update_documents  # noqa: E402
+
+
+class FakeCollection:
+    """In-memory stand-in for the parts of a Chroma collection the indexer uses."""
+
+    def __init__(self):
+        self.records = {}
+
+    def get(self, include=None):
+        ids = list(self.records)
+        return {
+            "ids": ids,
+            "documents": [self.records[i]["document"] for i in ids],
+            "metadatas": [self.records[i]["metadata"] for i in ids],
+            "embeddings": [self.records[i]["embedding"] for i in ids],
+        }
+
+    def upsert(self, ids, embeddings, documents, metadatas=None):
+        for position, doc_id in enumerate(ids):
+            self.records[doc_id] = {
+                "document": documents[position],
+                "metadata": metadatas[position] if metadatas else None,
+                "embedding": embeddings[position],
+            }
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self.records.pop(doc_id, None)
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self._collection = FakeCollection()
+        self.embeddings = CountingEmbeddings()
+
+
+FOODS = [
+    ("Apples, raw", {"Energy": "52 kcal"}),
+    ("Rice, white, cooked", {"Energy": "130 kcal"}),
+    ("Rice, white, cooked", {"Energy": "131 kcal"}),
+    ("Salt, table", {}),
+]
+
+
+def _legacy_store():
+    # Built the old way: random uuid4 ids, vectors already paid for
+    store = FakeVectorStore()
+    for description, metadata in FOODS:
+        store._collection.upsert(
+            ids=[str(uuid.uuid4())], embeddings=[[0.5]], documents=[description],
+            metadatas=[metadata] if metadata else None
+        )
+    return store
+
+
+def test_update_of_uuid_keyed_collection_reembeds_nothing(tmp_path):
+    store = _legacy_store()
+    texts = [description for description, _ in FOODS]
+    metadatas = [metadata for _, metadata in FOODS]
+
+    stats = update_documents(store, texts, metadatas, str(tmp_path))
+
+    assert store.embeddings.embedded == []
+    assert stats == {"added": 0, "changed": 0, "removed": 0, "unchanged": len(FOODS)}
+    assert sorted(store._collection.records) == sorted(document_ids(texts))
+    # The existing vectors were kept under the new ids
+    assert all(record["embedding"] == [0.5] for record in store._collection.records.values())
+    assert (tmp_path / MANIFEST_NAME).is_file()
+
+
+def test_update_of_uuid_keyed_collection_embeds_only_the_delta(tmp_path):
+    store = _legacy_store()
+    foods = FOODS[:3] + [("Bananas, raw", {"Energy": "89 kcal"})]
+    texts = [description for description, _ in foods]
+    metadatas = [metadata for _, metadata in foods]
+
+    stats = update_documents(store, texts, metadatas, str(tmp_path))
+
+    assert store.embeddings.embedded == ["Bananas, raw"]
+    assert stats == {"added": 1, "changed": 0, "removed": 1, "unchanged": 3}
+    assert sorted(store._collection.records) == sorted(document_ids(texts))
+
+
+def test_rerunning_a_finished_build_embeds_nothing(tmp_path):
+    store = FakeVectorStore()
+    texts = [description for description, _ in FOODS]
+    metadatas = [metadata for _, metadata in FOODS]
+
+    update_documents(store, texts, metadatas, str(tmp_path))
+    assert len(store.embeddings.embedded) == len(FOODS)
+
+    store.embeddings.embedded = []
+    stats = update_documents(store, texts, metadatas, str(tmp_path))
+
+    assert store.embeddings.embedded == []
+    assert stats == {"added": 0, "changed": 0, "removed": 0, "unchanged": len(FOODS)}